@@ -0,0 +1,98 @@
+"""
+Measures channel membership upkeep in big rooms: filling each room from its ICH, then a stream of JCH and LCH as
+characters join and leave. Frames go through received_message(), the same way the server's would; nothing is sent and
+the client is never connected.
+
+Usage: python benchmarks/channels.py [rooms] [room size] [joins and leaves]
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# So the script runs straight from a checkout, without installing the package first.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fchatpy import FChatClient
+
+
+class BenchClient(FChatClient):
+    def get_ticket(self, new_ticket=False):
+        return "ticket"
+
+
+def room_frames(rooms, size, churn, seed=1):
+    """
+    :return: Tuple of the frames that log in and fill the rooms, and the frames that join and leave them afterwards.
+    """
+    rng = random.Random(seed)
+    names = ["Character %d" % number for number in range(rooms * size + churn)]
+    setup = ['IDN {"character":"Bench"}']
+    for start in range(0, len(names), 100):
+        setup.append("LIS " + json.dumps({"characters": [[name, "None", "online", ""]
+                                                         for name in names[start:start + 100]]}))
+    fill = []
+    members = []
+    for room in range(rooms):
+        channel = "ADH-%d" % room
+        setup.append("JCH " + json.dumps({"character": {"identity": "Bench"}, "channel": channel,
+                                          "title": "Room %d" % room}))
+        inside = names[room * size:(room + 1) * size]
+        fill.append("ICH " + json.dumps({"users": [{"identity": name} for name in inside], "channel": channel,
+                                         "mode": "both"}))
+        members.append(list(inside))
+
+    outside = names[rooms * size:]
+    changes = []
+    for _ in range(churn):
+        room = rng.randrange(rooms)
+        channel = "ADH-%d" % room
+        if outside and (rng.random() < 0.5 or not members[room]):
+            name = outside.pop(rng.randrange(len(outside)))
+            members[room].append(name)
+            changes.append("JCH " + json.dumps({"character": {"identity": name}, "channel": channel,
+                                                "title": "Room %d" % room}))
+        else:
+            name = members[room].pop(rng.randrange(len(members[room])))
+            outside.append(name)
+            changes.append("LCH " + json.dumps({"channel": channel, "character": name}))
+    return setup, fill, changes
+
+
+def run(setup, fill, changes, repeats=3):
+    """
+    :return: Tuple of the best times taken to fill the rooms, and to join and leave them.
+    """
+    best_fill = best_changes = None
+    for _ in range(repeats):
+        client = BenchClient("account", "password", "Bench")
+        for frame in setup:
+            client.received_message(None, frame)
+        started = time.perf_counter()
+        for frame in fill:
+            client.received_message(None, frame)
+        filled = time.perf_counter()
+        for frame in changes:
+            client.received_message(None, frame)
+        finished = time.perf_counter()
+        best_fill = filled - started if best_fill is None else min(best_fill, filled - started)
+        best_changes = finished - filled if best_changes is None else min(best_changes, finished - filled)
+    return best_fill, best_changes
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    churn = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    logging.disable(logging.CRITICAL)
+    setup, fill, changes = room_frames(rooms, size, churn)
+    fill_time, changes_time = run(setup, fill, changes)
+    print("Filled %d rooms of %d characters in %.3f s: %.0f members/sec" % (
+        rooms, size, fill_time, rooms * size / fill_time))
+    print("%d joins and leaves in %.3f s: %.0f frames/sec" % (churn, changes_time, churn / changes_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures how many incoming frames per second received_message() gets through during a login storm: the VAR, FRL, IGN,
+ADL and LIS burst that follows IDN, then a stream of mostly NLN, FLN and STA with some chat mixed in. Nothing is sent;
+the client is never connected.
+
+Usage: python benchmarks/dispatch.py [users] [traffic frames]
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# So the script runs straight from a checkout, without installing the package first.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fchatpy import FChatClient
+
+GENDERS = ["Male", "Female", "Transgender", "Herm", "Shemale", "Male-Herm", "Cunt-boy", "None"]
+STATUSES = ["online", "looking", "busy", "dnd", "idle", "away"]
+
+
+class BenchClient(FChatClient):
+    def get_ticket(self, new_ticket=False):
+        return "ticket"
+
+
+def login_storm(users, traffic, seed=1):
+    """
+    :return: List of frames, as the server would send them.
+    """
+    rng = random.Random(seed)
+    names = ["Character %d" % number for number in range(users)]
+    frames = ['IDN {"character":"Bench"}']
+    for variable, value in [("chat_max", 4096), ("priv_max", 50000), ("lfrp_max", 50000), ("lfrp_flood", 600),
+                            ("msg_flood", 0.5), ("permissions", 0)]:
+        frames.append("VAR " + json.dumps({"variable": variable, "value": value}))
+    frames.append('HLO {"message":"Welcome. Running F-Chat (bench)."}')
+    frames.append("CON " + json.dumps({"count": users}))
+    frames.append("FRL " + json.dumps({"characters": names[:50]}))
+    frames.append('IGN {"action":"init","characters":[]}')
+    frames.append("ADL " + json.dumps({"ops": names[:20]}))
+    for start in range(0, users, 100):
+        frames.append("LIS " + json.dumps({"characters": [
+            [name, rng.choice(GENDERS), rng.choice(STATUSES), "Status message of %s" % name if rng.random() < 0.3
+             else ""] for name in names[start:start + 100]]}))
+
+    online = set(names)
+    offline = []
+    for number in range(traffic):
+        roll = rng.random()
+        if roll < 0.6:
+            frames.append("STA " + json.dumps({"status": rng.choice(STATUSES), "character": rng.choice(names),
+                                               "statusmsg": "Now with message %d" % number}))
+        elif roll < 0.75 and online:
+            name = online.pop()
+            offline.append(name)
+            frames.append("FLN " + json.dumps({"character": name}))
+        elif roll < 0.9 and offline:
+            name = offline.pop()
+            online.add(name)
+            frames.append("NLN " + json.dumps({"identity": name, "gender": rng.choice(GENDERS), "status": "online"}))
+        elif roll < 0.95:
+            frames.append("MSG " + json.dumps({"character": rng.choice(names), "message": "Hello there %d" % number,
+                                               "channel": "ADH-%d" % rng.randrange(20)}))
+        else:
+            frames.append("PRI " + json.dumps({"character": rng.choice(names), "message": "Hi %d" % number}))
+    return frames
+
+
+def run(frames, repeats=3):
+    best = None
+    for _ in range(repeats):
+        client = BenchClient("account", "password", "Bench")
+        started = time.perf_counter()
+        for frame in frames:
+            client.received_message(None, frame)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    traffic = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    logging.disable(logging.CRITICAL)
+    frames = login_storm(users, traffic)
+    elapsed = run(frames)
+    print("%d frames (%d users, %d traffic frames) in %.3f s: %.0f frames/sec" % (
+        len(frames), users, traffic, elapsed, len(frames) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures how much memory the client keeps per online character and per channel after a full-server login: the LIS
+burst listing every online character, then CHA and ORS listing every channel, with a CDS description for each. Only
+memory still held once the frames have been handled is counted, so the frames themselves don't skew the numbers.
+
+Usage: python benchmarks/memory.py [users] [channels]
+"""
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import tracemalloc
+
+# So the script runs straight from a checkout, without installing the package first.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fchatpy import FChatClient
+
+GENDERS = ["Male", "Female", "Transgender", "Herm", "Shemale", "Male-Herm", "Cunt-boy", "None"]
+STATUSES = ["online", "looking", "busy", "dnd", "idle", "away"]
+WORDS = ["looking", "for", "long", "term", "roleplay", "fantasy", "sci-fi", "modern", "slice", "of", "life", "ask",
+         "me", "about", "my", "plots", "ooc", "welcome", "rules", "please", "be", "nice", "no", "spam", "café"]
+
+
+class BenchClient(FChatClient):
+    def get_ticket(self, new_ticket=False):
+        return "ticket"
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def user_frames(users, seed=1):
+    """
+    :return: LIS frames listing the given number of characters, 100 to a frame like the server sends them.
+    """
+    rng = random.Random(seed)
+    frames = []
+    for start in range(0, users, 100):
+        frames.append("LIS " + json.dumps({"characters": [
+            ["Character %d" % number, rng.choice(GENDERS), rng.choice(STATUSES),
+             text(rng, rng.randrange(3, 15)) if rng.random() < 0.4 else ""]
+            for number in range(start, min(start + 100, users))]}))
+    return frames
+
+
+def channel_frames(channels, seed=1):
+    """
+    :return: CHA and ORS frames splitting the given number of channels between public and private, and a CDS frame
+    with a description for each.
+    """
+    rng = random.Random(seed)
+    public = ["Public Room %d" % number for number in range(channels // 10)]
+    private = [("ADH-%020x" % rng.getrandbits(80), "Private Room %d" % number)
+               for number in range(channels - len(public))]
+    frames = ["CHA " + json.dumps({"channels": [{"name": name, "mode": rng.choice(["chat", "ads", "both"]),
+                                                 "characters": rng.randrange(1, 1500)} for name in public]}),
+              "ORS " + json.dumps({"channels": [{"name": name, "title": title, "characters": rng.randrange(1, 50)}
+                                                for name, title in private]})]
+    for name in public + [name for name, _ in private]:
+        frames.append("CDS " + json.dumps({"channel": name, "description": text(rng, rng.randrange(20, 200))}))
+    return frames
+
+
+def retained(client, frames):
+    """
+    :return: Bytes still allocated after the client has handled the frames.
+    """
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    for frame in frames:
+        client.received_message(None, frame)
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    logging.disable(logging.CRITICAL)
+    users_lis = user_frames(users)
+    channels_list = channel_frames(channels)
+    client = BenchClient("account", "password", "Bench")
+    client.received_message(None, 'IDN {"character":"Bench"}')
+    tracemalloc.start()
+    user_bytes = retained(client, users_lis)
+    channel_bytes = retained(client, channels_list)
+    tracemalloc.stop()
+    print("%d users: %d bytes, %.0f bytes per user" % (users, user_bytes, user_bytes / users))
+    print("%d channels: %d bytes, %.0f bytes per channel" % (channels, channel_bytes, channel_bytes / channels))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures the outgoing queue under contention: many threads queue private messages at once while the client writes them
+out, each write taking a little while like a real socket's would. Reports how long the producers took to queue
+everything, how long until it had all been written, and how much CPU the client burns once it's idle again. The client
+is never connected; writes are counted instead of sent.
+
+Usage: python benchmarks/outgoing.py [threads] [messages per thread] [write latency in ms]
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+# So the script runs straight from a checkout, without installing the package first.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fchatpy import FChatClient
+
+
+class BenchClient(FChatClient):
+    outgoing_limits = {}  # Every message has to go out for the timing to mean anything, so none may be dropped.
+    write_latency = 0.0001
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.written = 0
+
+    def get_ticket(self, new_ticket=False):
+        return "ticket"
+
+    def send(self, data, *args, **kwargs):
+        time.sleep(self.write_latency)
+        self.written += 1
+
+
+def run(threads, messages, write_latency):
+    """
+    :return: Tuple of seconds taken to queue every message, seconds until they had all been written, and CPU seconds
+    used over one idle second afterwards.
+    """
+    client = BenchClient("account", "password", "Bench")
+    client.write_latency = write_latency
+    client.setup()
+    client.message_delay = 0
+    if hasattr(client.outgoing_buffer, "allow"):
+        # Chat is held back until the server says we're ready; there's no server here.
+        client.outgoing_buffer.allow("chat")
+
+    def produce(number):
+        for message in range(messages):
+            client.PRI("Character %d" % number, "Message %d" % message)
+
+    producers = [threading.Thread(target=produce, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    queued = time.perf_counter() - started
+    while client.written < threads * messages:
+        time.sleep(0.001)
+    written = time.perf_counter() - started
+
+    cpu = time.process_time()
+    time.sleep(1)
+    idle_cpu = time.process_time() - cpu
+    client.terminate_threads()
+    return queued, written, idle_cpu
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    write_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.1 / 1000
+    logging.disable(logging.CRITICAL)
+    queued, written, idle_cpu = run(threads, messages, write_latency)
+    total = threads * messages
+    print("%d threads queued %d messages in %.3f s: %.0f messages/sec" % (threads, total, queued, total / queued))
+    print("All written after %.3f s: %.0f messages/sec" % (written, total / written))
+    print("CPU used while idle: %.1f ms per second" % (idle_cpu * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import logging
+
 from fchatpy import FChatClient
 
 
@@ -9,8 +11,8 @@ class EchoBot(FChatClient):
     log_filter = ["PIN", "NLN", "FLN", "STA"]
 
     # Here's all the stuff we want the bot to do first thing when it connects.
-    def connect(self):
-        super().connect()  # Always call super first!
+    def on_ready(self):
+        super().on_ready()  # Always call super first!
         self.STA('online',  # Set status on login.
                  "Hello, I am an echo bot. I will echo your messages back to you!")
 
@@ -21,25 +23,16 @@ class EchoBot(FChatClient):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)  # Show everything in the console.
     bot = EchoBot(
         'username',  # Replace with account username
         'password',  # Replace with account password
         'character'  # Replace with name of character
     )
 
-    running = True
-
-    while running:
-        try:
-            bot.setup()
-            bot.run_forever()
-        except KeyboardInterrupt or SystemExit:
-            bot.logger.exception("Disconnected by user.")
-            running = False
-        except Exception:
-            bot.logger.exception("Unknown exception!")
-            bot.terminate_threads()
-            running = False
-        finally:
-            if running and bot:
-                bot.reconnect_stagger()
+    bot.keep_connected()  # Connect, and reconnect whenever the connection drops, waiting a little longer each time.
+    try:
+        bot.wait()  # Keep the program running until stopped with ctrl + c
+    except KeyboardInterrupt:
+        bot.logger.info("Disconnected by user.")
+        bot.stop()
@@ -1,3 +1,5 @@
+import logging
+
 from fchatpy import FChatClient
 
 """
@@ -12,6 +14,7 @@ class SimpleBot(FChatClient):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)  # Show everything in the console.
 
     bot = SimpleBot(
         'username',  # Replace with account username
@@ -19,5 +22,8 @@ if __name__ == "__main__":
         'character'  # Replace with name of character
     )
 
-    bot.setup()             # Get our ticket and prepare to connect
-    bot.run_forever()       # Keep the program running until stopped with ctrl + c
+    bot.keep_connected()    # Get our ticket and connect, and reconnect if the connection drops
+    try:
+        bot.wait()          # Keep the program running until stopped with ctrl + c
+    except KeyboardInterrupt:
+        bot.stop()
@@ -1,5 +1,20 @@
 from .user import *
 from .channel import *
+from .registry import *
+from .ratelimit import *
+from .outgoing import *
+from .codec import *
 from .client import *
+from .aio import *
+from .ticket import *
+from .world import *
+from .executor import *
+from .scheduler import *
+from .httppool import *
+from .throttle import *
+from .cache import *
+from .batch import *
+from .subscriptions import *
+from .manager import *
 
 __version__ = "0.3.0"
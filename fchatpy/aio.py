@@ -0,0 +1,200 @@
+import asyncio
+import inspect
+import time
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+from fchatpy.client import FChatProtocol
+
+
+async def _wait_for(awaitable):
+    return await awaitable
+
+
+class AsyncFChatClient(FChatProtocol):
+    """
+    An asyncio version of FChatClient. It has the same on_XXX handlers and command functions, but reading, sending and
+    keeping the connection alive are all tasks on one event loop instead of three threads, so a single process can run
+    any number of characters. Handlers may be plain functions or coroutines; coroutines are awaited before the next
+    message is read, so messages are still handled in order. With handler_workers, pooled handlers run on the pool's
+    threads, and any that are coroutines are run on the event loop from there. Requires the websockets package.
+    """
+    def __init__(self, account, password, character, url='wss://chat.f-list.net/chat2',
+                 client_name="Python FChat Library", codec=None):
+        """
+        :param account: Your account's username.
+        :param password: Your account's password.
+        :param character: The character you want to log in to.
+        :param url: URL of the websocket. Should be 'wss://chat.f-list.net/chat2' by default but can be redirected elsewhere.
+        :param client_name: Default set to "Python FChat Library".
+        :param codec: JSON codec used for messages, either a codec object or one of "orjson", "ujson" or "json". By
+        default, the fastest one installed is used.
+        """
+        super().__init__(account, password, character, client_name=client_name, codec=codec)
+        self.url = url
+        self.ws = None
+        self.running = False
+        self._loop = None
+        self._wakeup = None
+        self.outgoing_buffer.add_listener(self._queue_changed)
+
+    def _queue_changed(self):
+        # May be called from any thread, since commands can be queued from anywhere.
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _run_pooled(self, handler, command, data, args, kwargs):
+        # Runs on one of handler_pool's threads. Coroutines can only run on the event loop, so they're handed to it, and
+        # waited for here so the conversation's next handler still doesn't start until this one is done.
+        result = self._handle(handler, command, data, args, kwargs)
+        if inspect.isawaitable(result):
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                result.close()
+                self.logger.warning("Event loop is gone, dropped %s message.", command)
+                return
+            asyncio.run_coroutine_threadsafe(_wait_for(result), loop).result()
+
+    @staticmethod
+    def _require_websockets():
+        if websockets is None:
+            raise RuntimeError("AsyncFChatClient requires the websockets package: pip install fchatpy[async]")
+
+    async def setup(self):
+        """
+        Gets a ticket for connecting, without blocking the event loop while doing so.
+        :return: True if able to get a ticket, False if unable to get a ticket.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_ticket) is not None
+
+    async def run_once(self):
+        """
+        Connects to the websocket and handles messages until the connection closes. Call setup() first.
+        """
+        self._require_websockets()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        async with websockets.connect(self.url, max_size=None, ping_interval=None) as ws:
+            self.ws = ws
+            self.last_ping_received = time.time()
+            self.outgoing_buffer.open()
+            tasks = [asyncio.ensure_future(self.outgoing_pump()), asyncio.ensure_future(self.keep_alive())]
+            try:
+                self.connection_opened()
+                async for message in ws:
+                    # Like websocket-client does for FChatClient, a handler that raises is logged rather than allowed to
+                    # take the whole connection down.
+                    try:
+                        result = self.received_message(ws, message)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception:
+                        self.logger.exception("Exception while handling %s message.", message[:3])
+            finally:
+                self.outgoing_buffer.close()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.ws = None
+                self.connection_closed()
+                self.on_closed(ws.close_code, ws.close_reason)
+
+    async def run_forever(self):
+        """
+        Keeps the character connected until stop() is called, reconnecting with increasing delays whenever the
+        connection is lost.
+        """
+        self._require_websockets()
+        self.running = True
+        while self.running:
+            try:
+                if await self.setup():
+                    await self.run_once()
+            except (OSError, websockets.exceptions.WebSocketException):
+                self.logger.exception("Connection failed.")
+            except Exception:
+                # A bug somewhere in our own code, such as a hook. Better to log it and reconnect than to stop for good.
+                self.logger.exception("Unexpected error while connected.")
+            if self.running:
+                await self.reconnect_stagger()
+
+    async def stop(self):
+        """
+        Disconnects, and makes run_forever() return instead of reconnecting.
+        """
+        self.running = False
+        if self.ws is not None:
+            await self.ws.close(reason="Disconnected by user.")
+
+    async def outgoing_pump(self):
+        """
+        Sends queued messages as the rate limiter allows. Sleeps until a message is queued or a flood limit runs out,
+        rather than checking the queue over and over.
+        """
+        while True:
+            # Cleared before looking, so a message queued in the meantime sets it again and isn't missed.
+            self._wakeup.clear()
+            frame, wait = self.outgoing_buffer.poll()
+            if frame is not None:
+                try:
+                    await self.ws.send(self.format_frame(*frame))
+                except websockets.exceptions.WebSocketException:
+                    # The connection is gone; keep the message for the next one (pings and IDN are dropped).
+                    self.outgoing_buffer.requeue(*frame)
+                    return
+                continue
+            if self.outgoing_buffer.closed:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def keep_alive(self):
+        """
+        Sends a ping every keepalive_interval seconds, and closes the connection if the server hasn't pinged us in
+        keepalive_timeout seconds. Sleeps until whichever of those is due next.
+        """
+        while True:
+            now = time.time()
+            if now - self.last_ping_received > self.keepalive_timeout:
+                self.logger.info("Didn't get a ping in time. Restarting.")
+                await self.ws.close(reason="%g seconds since last ping." % self.keepalive_timeout)
+                return
+            if now - self.last_ping_sent > self.keepalive_interval:
+                self.PIN()
+            due = min(self.last_ping_sent + self.keepalive_interval,
+                      self.last_ping_received + self.keepalive_timeout)
+            await asyncio.sleep(max(due - time.time(), 0) + 0.01)
+
+    def run_job(self, function, args):
+        # Jobs run on the event loop rather than the scheduler's thread, and may be coroutines.
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._start_job, function, args)
+
+    def _start_job(self, function, args):
+        result = function(*args)
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result)
+
+    def on_closed(self, code, reason=None):
+        """
+        Automatically called when the connection is closed. Logs reason for closing.
+        :param code:
+        :param reason:
+        """
+        self.logger.info("Closing (" + str(code) + ", " + str(reason) + ")!")
+
+    async def reconnect_stagger(self):
+        self.logger.info("Trying to reconnect in %d seconds (attempt number %d) ..." % (
+            self.reconnect_delay, self.reconnect_attempt))
+        await asyncio.sleep(self.reconnect_delay)
+        if self.reconnect_delay < 120:
+            self.reconnect_delay *= 2
+        self.reconnect_attempt += 1
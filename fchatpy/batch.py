@@ -0,0 +1,45 @@
+import concurrent.futures
+
+from fchatpy.ratelimit import BlockingTokenBucket
+
+
+class BatchFetcher(object):
+    """
+    Runs many lookups at once on a bounded number of threads, handing back each result as soon as it's ready. Requests
+    are started no faster than rate per second, counting every batch run through the same BatchFetcher.
+    """
+
+    def __init__(self, workers=8, rate=None, burst=None):
+        """
+        :param workers: Most lookups running at once.
+        :param rate: Most lookups to start per second. None for no limit.
+        :param burst: Number of lookups that may start back to back after a quiet period. Default is workers.
+        """
+        self.workers = workers
+        self.bucket = BlockingTokenBucket(1.0 / rate, burst or workers) if rate else None
+
+    def _run(self, fetch, key):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        return fetch(key)
+
+    def map(self, fetch, keys):
+        """
+        Looks up every key, several at a time.
+        :param fetch: Function that takes a key and returns its result.
+        :param keys: Keys to look up.
+        :return: Generator of (key, result, error) tuples, in the order they finish. error is the exception the lookup
+        raised, in which case result is None. Stopping early cancels the lookups that haven't started yet.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        futures = {}
+        try:
+            for key in keys:
+                futures[executor.submit(self._run, fetch, key)] = key
+            for future in concurrent.futures.as_completed(futures):
+                error = future.exception()
+                yield futures[future], (None if error is not None else future.result()), error
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,140 @@
+import collections
+import threading
+import time
+
+
+class _Flight(object):
+    """
+    A fetch in progress, which everyone else asking for the same key waits on.
+    """
+    __slots__ = ('done', 'value', 'error', 'stale')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False  # Set if the key was invalidated mid-fetch, so the result mustn't be kept.
+
+
+class TTLCache(object):
+    """
+    Thread-safe cache that forgets entries after ttl seconds, and the least recently used ones once it holds more than
+    max_size. If several threads ask for the same missing key at once, only the first one fetches it; the rest wait for
+    that result instead of making requests of their own.
+    """
+
+    def __init__(self, ttl=600, max_size=1000, cache_if=None):
+        """
+        :param ttl: Number of seconds an entry stays good for.
+        :param max_size: Most entries to keep.
+        :param cache_if: Function that's given each fetched value, and returns whether to keep it. Ex: to not keep
+        error replies. By default, everything is kept.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_if = cache_if
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Misses that waited on another thread's fetch instead of fetching.
+        self.evictions = 0  # Entries dropped to stay within max_size.
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()  # (expiry time, value) for each key, least recently used first.
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """
+        :param key: What to look up.
+        :param fetch: Function called with no arguments to get the value if it isn't cached. If it raises, the exception
+        is passed on to everyone waiting for it, and nothing is cached.
+        :return: The cached or fetched value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+
+            self.misses += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            if self.cache_if is None or self.cache_if(flight.value):
+                with self._lock:
+                    if not flight.stale:
+                        self._store(key, flight.value)
+            return flight.value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Forgets a key, including the result of any fetch for it that's still in progress.
+        """
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(key, None)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def clear(self):
+        """
+        Forgets everything.
+        """
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            for flight in self._flights.values():
+                flight.stale = True
+
+    def stats(self):
+        """
+        :return: Dictionary of hits, misses, coalesced, evictions, expirations, invalidations, size, and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
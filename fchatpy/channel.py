@@ -1,4 +1,20 @@
+import sys
+
+
+def _member_key(character):
+    """
+    Characters can be given to a channel either as User objects or just by name. Either way, they're stored by their
+    lower case name.
+    """
+    if isinstance(character, str):
+        return character.lower()
+    return character.name.lower()
+
+
 class Channel(object):
+    __slots__ = ('id', 'title', '_mode', 'members', 'members_known', 'reported_characters', 'owner', 'channel_ops',
+                 '_description')
+
     def __init__(self, channel_id, title, num_characters):
         """
         This object class helps you keep track of all the channels.
@@ -12,11 +28,59 @@ class Channel(object):
         self.id = channel_id
         self.title = title
         self.mode = ""
-        self.num_characters = num_characters
-        self.character_list = []
+        self.members = {}  # Characters in the room. Key is character name (lower case), in the order they joined.
+        self.members_known = False  # True once we've been told who's in the room, rather than just how many.
+        self.reported_characters = num_characters
         self.owner = {}
         self.channel_ops = []
-        self.description = {}
+        self.description = ""
+
+    @property
+    def mode(self):
+        """
+        Enum of "chat", "ads", or "both". Interned, since every channel has one of the same three values.
+        """
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = sys.intern(mode)
+
+    @property
+    def description(self):
+        """
+        The channel's description. These can be long, so they're stored as UTF-8 bytes. Lone surrogates, which JSON
+        allows, are kept as they are.
+        """
+        return self._description.decode("UTF-8", "surrogatepass")
+
+    @description.setter
+    def description(self, description):
+        self._description = description.encode("UTF-8", "surrogatepass") if description else b''
+
+    @property
+    def character_list(self):
+        """
+        List of characters in the room, in the order they joined.
+        """
+        return list(self.members.values())
+
+    @property
+    def num_characters(self):
+        """
+        Number of characters in the room. Once we know who's in the room, this is always the size of the member list.
+        Until then, it's the population the server last told us about.
+        """
+        if self.members_known:
+            return len(self.members)
+        return self.reported_characters
+
+    @num_characters.setter
+    def num_characters(self, num_characters):
+        self.reported_characters = num_characters
+
+    def __contains__(self, character):
+        return _member_key(character) in self.members
 
     def update(self, channel_id, title, num_characters):
         """
@@ -29,20 +93,27 @@ class Channel(object):
         self.title = title
         self.num_characters = num_characters
 
+    def set_characters(self, characters):
+        """
+        Replaces the member list with the given characters. Used when we get the full list of the room's users.
+        :param characters: Characters in the room. Use the User object class, or character names.
+        """
+        self.members = {_member_key(character): character for character in characters}
+        self.members_known = True
+
     def joined(self, character):
         """
         To be called when a character joins a room.
-        :param character: Character that just joined the room. Use the User object class.
+        :param character: Character that just joined the room. Use the User object class, or the character's name.
         """
-        if character not in self.character_list:
-            self.character_list.append(character)
-            self.num_characters += 1
+        key = _member_key(character)
+        if key not in self.members:
+            self.members[key] = character
+        self.members_known = True
 
     def left(self, character):
         """
         To be called when a character leaves a room.
-        :param character: Character that just left the room. Use the Character object class.
+        :param character: Character that just left the room. Use the User object class, or the character's name.
         """
-        if character in self.character_list:
-            self.character_list.remove(character)
-            self.num_characters -= 1
+        self.members.pop(_member_key(character), None)
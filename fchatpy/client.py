@@ -1,65 +1,343 @@
 import websocket
-import threading
 import time
 import json
-import urllib
-import urllib.request
-import urllib.parse
 import logging
+from operator import itemgetter
+import inspect
+import threading
+import collections.abc
 
 from fchatpy.user import User
 from fchatpy.channel import Channel
+from fchatpy.codec import get_codec
+from fchatpy.registry import UserRegistry
+from fchatpy.outgoing import OutgoingQueue
+from fchatpy.ratelimit import RateLimiter
+from fchatpy.ticket import default_ticket_manager
+from fchatpy.executor import HandlerPool, default_sender_pool
+from fchatpy.scheduler import default_scheduler
+from fchatpy.httppool import default_http_client
+from fchatpy.cache import TTLCache
+from fchatpy.batch import BatchFetcher
+from fchatpy.subscriptions import SubscriptionRegistry
 
 
-class FChatClient(websocket.WebSocketApp):
-    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+_NO_KWARGS = {}
+
+
+def _decode_payload(json_string, codec):
+    try:
+        return codec.loads(json_string)
+    except:
+        return {}
+
+
+class LazyPayload(collections.abc.Mapping):
+    """
+    Read-only view of a message's JSON data that is only decoded the first time something is looked up in it. Used in
+    place of a dict in lazy_decode mode, where a handler may well never look at the data it was given.
+    """
+
+    def __init__(self, json_string, codec):
+        self._json_string = json_string
+        self._codec = codec
+        self._data = None
+
+    def _decoded(self):
+        if self._data is None:
+            self._data = _decode_payload(self._json_string, self._codec)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._decoded()[key]
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def __repr__(self):
+        if self._data is None:
+            return self._json_string
+        return repr(self._data)
+
+
+def _fields(*keys):
+    """
+    Builds an argument extractor for commands whose handler simply takes some payload keys, in order.
+    :param keys: Keys to pull out of the decoded payload.
+    :return: Function turning a payload into an (args, kwargs) pair.
+    """
+    getter = itemgetter(*keys)
+    if len(keys) == 1:
+        return lambda data: ((getter(data),), _NO_KWARGS)
+    return lambda data: (getter(data), _NO_KWARGS)
+
+
+def _extract_jch(data):
+    return (data['character']['identity'], data['channel'], data['title']), _NO_KWARGS
+
+
+def _extract_kid(data):
+    if data['type'] == 'start' or data['type'] == 'end':
+        return (data['type'], data['character'], data['message']), _NO_KWARGS
+    elif data['type'] == 'custom':
+        return (data['type'], data['character'], data['key'], data['value']), _NO_KWARGS
+    return None
+
+
+def _extract_ign(data):
+    if data['action'] == 'init':
+        return (data['action'],), {'characters': data['characters']}
+    elif data['action'] == 'add' or data['action'] == 'delete':
+        return (data['action'],), {'character': data['character']}
+    return None
+
+
+def _extract_rll(data):
+    if data['type'] == 'dice':
+        return (data['channel'], data['type'], data['character'], data['message']), {
+            'results': data['results'], 'rolls': data['rolls'], 'endresult': data['endresult']}
+    elif data['type'] == 'bottle':
+        return (data['channel'], data['type'], data['character'], data['message']), {'target': data['target']}
+    return None
+
+
+_RTB_NAME_TYPES = frozenset(["trackadd", "trackrem", "friendadd", "friendremove", "friendrequest"])
+
+
+def _extract_rtb(data):
+    if data['type'] in _RTB_NAME_TYPES:
+        return (data['type'],), {'name': data['name']}
+    elif data['type'] == 'note':
+        return (data['type'],), {'sender': data['sender'], 'note_id': data['id'], 'subject': data['subject']}
+    return None
+
+
+def _extract_sys(data):
+    if 'channel' in data:
+        return (data['message'],), {'channel': data['channel']}
+    return (data['message'],), _NO_KWARGS
+
+
+def _no_error(reply):
+    # F-List reports errors in the reply rather than with an HTTP status, and those shouldn't be cached.
+    return not reply.get('error')
+
+
+def _raw_payload(data):
+    return (data,), _NO_KWARGS
+
+
+def _instance_handler(function):
+    # Handlers assigned on an instance don't take self, unlike the class's functions that the dispatch table holds.
+    return lambda client, *args, **kwargs: function(*args, **kwargs)
+
+
+async def _await_all(result, pending):
+    # Awaits an on_XXX handler's result, if it needs it, along with the subscribed handlers that are coroutines.
+    if inspect.isawaitable(result):
+        result = await result
+    for awaitable in pending:
+        try:
+            await awaitable
+        except Exception:
+            FChatProtocol.logger.exception("Exception in subscribed handler.")
+    return result
+
+
+# Every server command we understand, mapped to the name of its handler and a function that turns the decoded payload
+# into the handler's arguments. Extractors return None when a sub-type isn't supported, in which case nothing is called.
+COMMANDS = {
+    "ADL": ("on_ADL", _fields('ops')),  # Chatops list
+    "AOP": ("on_AOP", _fields('character')),  # Chatops promotion
+    "BRO": ("on_BRO", _fields('message')),  # Admin broadcast
+    "CDS": ("on_CDS", _fields('channel', 'description')),  # Channel description change
+    "CHA": ("on_CHA", _fields('channels')),  # Public channels list
+    "CIU": ("on_CIU", _fields('sender', 'title', 'name')),  # Channel invite
+    "CBU": ("on_CBU", _fields('operator', 'channel', 'character')),  # User banned from channel
+    "CKU": ("on_CKU", _fields('operator', 'channel', 'character')),  # User kicked from channel
+    "COA": ("on_COA", _fields('character', 'channel')),  # Channel op promotion
+    "COL": ("on_COL", _fields('channel', 'oplist')),  # Channel ops list
+    "CON": ("on_CON", _fields('count')),  # Number of connected users
+    "COR": ("on_COR", _fields('character', 'channel')),  # Channel op demotion
+    "CSO": ("on_CSO", _fields('character', 'channel')),  # Channel owner promotion
+    "CTU": ("on_CTU", _fields('operator', 'channel', 'length', 'character')),  # Channel temp ban
+    "DOP": ("on_DOP", _fields('character')),  # Chatops demotion
+    "ERR": ("on_ERR", _fields('message', 'number')),  # Error notification
+    "FKS": ("on_FKS", _fields('characters', 'kinks')),  # Search results
+    "FLN": ("on_FLN", _fields('character')),  # User disconnected
+    "HLO": ("on_HLO", _fields('message')),  # Hello command
+    "ICH": ("on_ICH", _fields('users', 'channel', 'mode')),  # Initial channel data
+    "IDN": ("on_IDN", _fields('character')),  # Identification successful
+    "JCH": ("on_JCH", _extract_jch),  # User joined channel
+    "KID": ("on_KID", _extract_kid),  # Kink data
+    "LCH": ("on_LCH", _fields('channel', 'character')),  # User left channel
+    "LIS": ("on_LIS", _fields('characters')),  # Online characters list
+    "NLN": ("on_NLN", _fields('identity', 'gender', 'status')),  # User connected
+    "IGN": ("on_IGN", _extract_ign),  # Ignore list
+    "FRL": ("on_FRL", _fields('characters')),  # Friends list
+    "ORS": ("on_ORS", _fields('channels')),  # Private channels list
+    "PIN": ("on_PIN", lambda data: ((), _NO_KWARGS)),  # Ping from server
+    "PRD": ("on_PRD", _fields('type', 'message', 'key', 'value')),  # Profile data
+    "PRI": ("on_PRI", _fields('character', 'message')),  # Private message
+    "MSG": ("on_MSG", _fields('character', 'message', 'channel')),  # Message in channel
+    "LRP": ("on_LRP", _fields('channel', 'message', 'character')),  # Ad in channel
+    "RLL": ("on_RLL", _extract_rll),  # Dice roll results
+    "RMO": ("on_RMO", _fields('mode', 'channel')),  # Room ad mode changed
+    "RTB": ("on_RTB", _extract_rtb),  # Real-time bridge
+    "SFC": ("on_SFC", _raw_payload),  # Alert admins and chatops. TODO: Add more inputs
+    "STA": ("on_STA", _fields('status', 'character', 'statusmsg')),  # User changes status
+    "SYS": ("on_SYS", _extract_sys),  # Message generated by server
+    "TPN": ("on_TPN", _fields('character', 'status')),  # User typing status
+    "UPT": ("on_UPT", _fields('time', 'starttime', 'startstring', 'accepted', 'channels', 'users',
+                              'maxusers')),  # Server up-time
+    "VAR": ("on_VAR", _fields('variable', 'value')),  # Server variables
+}
+
+# Commands whose default handlers do nothing at all.
+PASSIVE_COMMANDS = frozenset([
+    "AOP", "BRO", "CBU", "CIU", "DOP", "ERR", "FKS", "HLO", "KID", "LRP", "MSG", "PRD", "PRI", "RLL", "RMO",
+    "SFC", "SYS", "TPN", "UPT"
+])
+
+# Connection states, in order. See FChatProtocol.state.
+STATES = ("disconnected", "connected", "identified", "ready")
+
+# Commands whose default handlers only keep the list of online users up to date. FLN isn't one of them, as it also
+# removes the character from our channels.
+PRESENCE_COMMANDS = frozenset(["LIS", "NLN", "STA"])
+
+
+class FChatProtocol(object):
+    """
+    Everything needed to speak F-Chat, without the connection itself: keeping track of users and channels, calling the
+    on_XXX handlers for incoming messages, queueing outgoing commands, and F-List's JSON endpoints. FChatClient and
+    AsyncFChatClient add a websocket to this. Override on_XXX functions in a child class of one of those.
+    """
     logger = logging.getLogger("fchat")
     log_filter = []  # Override and add the three-letter commands you want to add (in string form).
     log_pings = False  # Set to true if you want to see your outgoing pings every 30 seconds.
+    log_sampling = {}  # Map a command to N to only log every Nth one of them. Ex: {"STA": 100}
+    log_max_length = 1000  # Logged message data longer than this gets cut short. Set to 0 to never cut anything.
     version_num = '0.3.0'
+    outgoing_limits = {"state": 1000, "chat": 1000}  # Most messages of each priority class that may be waiting to send.
+    coalesce_outgoing = False  # Set to true to merge or drop redundant queued messages. See OutgoingQueue.
+    lazy_decode = False  # Set to true to skip decoding messages nothing in your class would use.
+    user_registry = UserRegistry  # Class used for self.users. Use ColumnarUserRegistry for compact, columnar storage.
+    track_presence = True  # Set to false if you don't need self.users, so NLN, STA and LIS can be skipped too.
+    ticket_manager = None  # TicketManager to get tickets from. None uses default_ticket_manager(), shared by every client.
+    api_cache_ttls = {"profile": 600, "images": 600, "friends": 300, "memo": 300}  # Seconds to cache each kind of
+    # character lookup for. Leave a kind out to not cache it.
+    api_cache_size = 1000  # Most characters to cache each kind of lookup for.
+    batch_workers = 8  # Most character lookups fetch_characters() runs at once.
+    batch_rate = 20  # Most character lookups fetch_characters() starts per second. None for no limit.
+    http_client = None  # HTTPClient for the JSON API. None uses default_http_client(), which is shared by every client.
+    scheduler = None  # Scheduler for timers. None uses default_scheduler(), which is shared by every client.
+    keepalive_interval = 30  # Seconds between the pings we send. Not named ping_interval, as WebSocketApp uses that.
+    keepalive_timeout = 90  # Seconds without a ping from the server before we give up on the connection.
+    ready_after = ("ADL", "FRL", "IGN", "LIS")  # Data we wait for before calling on_ready(). Add "CHA" to also get the
+    # list of public channels first; it's requested as soon as we're identified.
+    ready_timeout = 30  # Seconds after identifying to give up waiting for ready_after, and be ready anyway.
+    handler_workers = 0  # Set above 0 to run your message handlers (on_PRI, on_MSG...) on that many worker threads.
+    slow_handler_time = 5  # Seconds a pooled handler may run before it's reported as slow.
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._build_dispatch_table()
+
+    @classmethod
+    def _build_dispatch_table(cls):
+        """
+        Resolves every command's handler once for this class, so received_message() only needs a single dict lookup per
+        frame no matter which command it is. Handlers assigned on an instance (Ex: bot.on_PRI = f) are still honoured;
+        received_message() checks for those separately.
+        """
+        cls._dispatch_table = {
+            command: (extract, getattr(cls, handler_name), handler_name)
+            for command, (handler_name, extract) in COMMANDS.items()
+        }
 
-    def __init__(self, account, password, character, url='wss://chat.f-list.net/chat2',
-                 client_name="Python FChat Library"):
+        # Commands with no effective consumer: the handler hasn't been overridden, and the default one either does
+        # nothing or only maintains presence data we've been told not to track. Only used in lazy_decode mode.
+        unused = set()
+        for command, (handler_name, extract) in COMMANDS.items():
+            if getattr(cls, handler_name) is not getattr(FChatProtocol, handler_name, None):
+                continue
+            if command in PASSIVE_COMMANDS or (not cls.track_presence and command in PRESENCE_COMMANDS):
+                unused.add(command)
+        cls._unused_commands = frozenset(unused)
+
+        # Commands that go to the handler pool, if there is one: those whose default handler doesn't touch our state,
+        # but that have been overridden. Everything else runs right away, so the state is always up to date.
+        cls._pooled_commands = frozenset(
+            command for command in PASSIVE_COMMANDS
+            if getattr(cls, COMMANDS[command][0]) is not getattr(FChatProtocol, COMMANDS[command][0], None)
+        )
+
+        # Commands whose default handlers only update the online user list, which is left to the feeder when sharing a
+        # WorldState. FLN isn't one of them, as it also updates our channels.
+        cls._world_commands = frozenset(
+            command for command in ("LIS", "NLN", "STA")
+            if getattr(cls, COMMANDS[command][0]) is getattr(FChatProtocol, COMMANDS[command][0], None)
+        )
+
+    def __init__(self, account, password, character, client_name="Python FChat Library", codec=None):
         """
-        A websocket client that connects to the F-Chat websocket and handles messagages coming to/from it. Calling this will initialize a client to
-        connect one character to the F-Chat websocket.
         :param account: Your account's username.
         :param password: Your account's password.
         :param character: The character you want to log in to.
-        :param url: URL of the websocket. Should be 'wss://chat.f-list.net/chat2' by default but can be redirected elsewhere.
         :param client_name: Default set to "Python FChat Library".
+        :param codec: JSON codec used for messages, either a codec object or one of "orjson", "ujson" or "json". By
+        default, the fastest one installed is used.
         """
-        super().__init__(
-            url, header=None, on_open=self.on_opened, on_message=self.received_message, on_error=None,
-            on_close=self.on_closed, on_ping=None, on_pong=None, on_cont_message=None, keep_running=None,
-            get_mask_key=None, cookie=None, subprotocols=None, on_data=None, socket=None
-        )
-
         self.account = account
         self.password = password
         self.character_name = character
         self.client_name = client_name
-
-        self.outgoing_pump_running = False
-        self.connection_test_running = False
+        self.codec = get_codec(codec)
 
         self.operators = []
         self.server_vars = {}
-        self.users = {}  # Dictionary of online users. Key is username (lower case), object type is "User".
+        self.users = self.user_registry()  # Online users. Key is username (lower case), object type is "User".
         self.channels = {}  # Dictionary of channels. Key is channel ID (lower case), object type is "Channel".
+        self.user_channels = {}  # Channels each user is in, as far as we know. Key is username (lower case).
         self.friends = []
         self.ignored_users = []
-        self.outgoing_buffer = []
+        self.rate_limiter = RateLimiter()
+        self.outgoing_buffer = OutgoingQueue(self.rate_limiter, self.outgoing_limits, self.coalesce_outgoing)
+        self.outgoing_buffer.allow(None)  # Nothing goes out until we're connected. See connection_opened().
 
-        self.message_delay = 1
         self.ticket_time = 0
         self.ticket = ''
         self.last_ping_received = time.time()
         self.last_ping_sent = time.time()
 
-        self.buffer_lock = threading.Lock()
+        self.log_counts = {}  # How many of each sampled command we've seen, for log_sampling.
 
         self.connected = False
+        self.state = "disconnected"  # One of STATES: connected once the websocket is open, identified once the server
+        # has accepted our IDN, and ready once it has sent everything in ready_after.
+        self._awaiting = set()  # Commands we're waiting for before moving on to the next state.
+        self._ready_timer = None
+        self._ready_lock = threading.Lock()  # The ready timeout and the last awaited message may arrive together.
+        self.loading_users = False  # True while the server is sending us LIS messages.
+        self.users_loaded = False  # True once we've received the full list of online users.
+        self.expected_users = 0  # Number of online users according to CON.
+        self.users_received = 0  # Number of users the server has listed with LIS since we connected.
+        self.world = None  # WorldState shared with other clients, if attached to one.
+        self.scheduler = self.scheduler or default_scheduler()
+        self.http_client = self.http_client or default_http_client()
+        self.ticket_manager = self.ticket_manager or default_ticket_manager()
+        self.api_caches = {kind: TTLCache(ttl, self.api_cache_size, _no_error)
+                           for kind, ttl in self.api_cache_ttls.items()}
+        self.batch_fetcher = BatchFetcher(self.batch_workers, self.batch_rate)
+        self.subscriptions = SubscriptionRegistry()  # Handlers added with subscribe().
+        self.handler_pool = None
+        if self.handler_workers:
+            self.handler_pool = HandlerPool(self.handler_workers, slow_after=self.slow_handler_time,
+                                            name="%s-handler" % character)
 
         # We want to initialize these variables only if they don't already exist.
         try:
@@ -71,340 +349,388 @@ class FChatClient(websocket.WebSocketApp):
 
     def get_ticket(self, new_ticket=False):
         """
-        Will request a ticket from F-List.net. This ticket is required to connect to the websocket.
+        Will request a ticket from F-List.net. This ticket is required to connect to the websocket. Tickets come from
+        ticket_manager, which shares them with other clients on the same account and refreshes them before they expire.
+        :param new_ticket: If true, fetches a new ticket even if the current one hasn't expired yet.
         :return: If successful, returns ticket. If not successful, returns None.
         """
-
-        if self.ticket and time.time() - self.ticket_time < 30 * 60 and not new_ticket:
-            return self.ticket
-        else:
-            self.logger.info("Fetching ticket ...")
+        ticket = self.ticket_manager.get_ticket(self.account, self.password, new_ticket, http=self.http_client)
+        if ticket != self.ticket:
+            self.ticket = ticket or ''
             self.ticket_time = time.time()
+        return ticket
 
-            data = {'account': self.account, 'password': self.password}
-            data_enc = urllib.parse.urlencode(data)
-            data_enc = data_enc.encode("UTF-8")
-
-            response = urllib.request.urlopen('https://www.f-list.net/json/getApiTicket.php', data_enc)
-            text = response.read()
-            text_parsed = json.loads(text.decode("UTF-8"))
-
-            if 'ticket' in text_parsed:
-                self.ticket = text_parsed['ticket']
-                return self.ticket
-            else:
-                self.logger.error(text_parsed['error'])
-                return None
-
-    def setup(self):
-        """
-        This function should be called before connecting to the websocket. It will get a ticket for connecting and
-        start up some required threads. It will also initialize some values.
-        :return: True if able to get a ticket, False if unable to get a ticket.
-        """
-
-        if self.get_ticket() is None:
-            return False
-        else:
-            self.reconnect = threading.Thread(target=self.connection_test, args=(), name="reconnect-thread")
-            self.outgoing_thread = threading.Thread(target=self.outgoing_pump, args=(), name="outgoing-thread")
-
-            # self.outgoing_thread.setDaemon(False)
-            self.outgoing_thread.start()
-
-            self.reconnect_delay = 1
-            self.reconnect_attempt = 0
-            self.reconnect.setDaemon(False)
-            self.reconnect.start()
-
-            self.connected = False
-
-            return True
-
-    def outgoing_pump(self):
-        self.outgoing_pump_running = True
-        while self.outgoing_pump_running:
-            if self.connected and not self.sock:
-                self.logger.info("Turning off outgoing pump thread.")
-                break
-            elif len(self.outgoing_buffer):
-                self.send_one()
-                time.sleep(self.message_delay)
-            else:
-                time.sleep(0.01)
-
-    def connection_test(self):
-        self.connection_test_running = True
-        self.last_ping_received = time.time()
-        while self.connection_test_running:
-            if time.time() - self.last_ping_sent > 30:
-                self.PIN()
-                self.last_ping_sent = time.time()
-
-            if time.time() - self.last_ping_received > 90:
-                self.logger.info("Didn't get a ping in time. Restarting.")
-                self.close(reason="90 seconds since last ping.")
-                break
-
-            if self.connected and not self.sock:
-                self.logger.info("Turning off ping thread.")
-                break
-
-            time.sleep(0.1)
-
-    def terminate_threads(self):
-        """
-        This function should be called whenever we close our client, so that threads can safely end.
-        """
-        try:
-            if self.outgoing_thread.isAlive():
-                self.outgoing_pump_running = False
-                self.outgoing_thread.join()
-        except AttributeError:
-            pass  # Thread doesn't exist yet.
-
-        try:
-            if self.reconnect.isAlive():
-                self.connection_test_running = False
-                self.reconnect.join()
-        except AttributeError:
-            pass  # Thread doesn't exist yet.
-
-    def on_opened(self, ws):
+    def connection_opened(self):
         """
-        Automatically called when we successfully connect to the server. Resets reconnect delays, and sends sends an
+        Called by the transport once the websocket is open. Resets reconnect delays and connection state, and sends an
         IDN message.
         """
         self.reconnect_delay = 1
         self.reconnect_attempt = 0
+        self.loading_users = False
+        self.users_loaded = False
+        self.expected_users = 0
+        self.users_received = 0
+        if self.world is not None:
+            self.world.client_connected(self)
+        else:
+            # Whoever was online last time is out of date, and the server is about to list everyone again.
+            self.users.clear()
         self.logger.info("Connected!")
+
+        # Nothing but IDN and pings may go out until we're identified, and no chat until we're ready. Anything else
+        # queued in the meantime waits its turn.
+        self.state = "connected"
+        self._awaiting = {"IDN"}
+        # A ping queued for the old connection would otherwise go out first, and the server disconnects anyone who sends
+        # something before IDN.
+        self.outgoing_buffer.discard("control")
+        self.outgoing_buffer.allow("control")
         self.IDN(self.character_name)
-        time.sleep(5)  # Give the client some time to initialize before doing anything else.
 
-    def on_closed(self, ws, code, reason=None):
+    def connection_closed(self):
         """
-        Automatically  called when the client is closed. Terminates threads and logs reason for closing.
-        :param code:
-        :param reason:
+        Called by the transport once the websocket has closed.
         """
-        self.logger.info("Closing (" + str(code) + ", " + str(reason) + ")!")
-        self.terminate_threads()
+        self.connected = False
+        self.state = "disconnected"
+        self._awaiting = set()
+        self.outgoing_buffer.allow(None)
+        if self._ready_timer is not None:
+            self._ready_timer.cancel()
+            self._ready_timer = None
+        if self.world is not None:
+            self.world.client_disconnected(self)
+
+    def data_arrived(self, command):
+        """
+        Moves through the connection states as the server sends what each one waits for.
+        :param command: The three letter command that just arrived and was handled.
+        """
+        self._awaiting.discard(command)
+        if command == "IDN" and self.state == "connected":
+            self.state = "identified"
+            self._awaiting = set(self.ready_after)
+            if self.users_loaded:
+                self._awaiting.discard("LIS")
+            self.outgoing_buffer.allow("state")
+            if "CHA" in self._awaiting:
+                self.CHA()
+            if self.ready_timeout:
+                self._ready_timer = self.call_later(self.ready_timeout, self._ready_timed_out)
+            self.on_identified()
+
+        if self.state == "identified" and not self._awaiting:
+            self._become_ready()
+
+    def _ready_timed_out(self):
+        self._ready_timer = None
+        if self.state == "identified":
+            self.logger.warning("Still waiting for %s after %g seconds. Carrying on anyway.",
+                                ", ".join(sorted(self._awaiting)), self.ready_timeout)
+            self._become_ready()
+
+    def _become_ready(self):
+        with self._ready_lock:
+            if self.state != "identified":
+                # Already ready, or the connection has closed since.
+                return
+            if self._ready_timer is not None:
+                self._ready_timer.cancel()
+                self._ready_timer = None
+            self._awaiting = set()
+            self.state = "ready"
+        self.outgoing_buffer.allow("chat")
+        self.on_ready()
+
+    def owns_presence(self):
+        """
+        :return: True if this client keeps self.users up to date. Clients sharing a WorldState leave that to one of them.
+        """
+        return self.world is None or self.world.feeder is self
 
     def received_message(self, ws, m):
         """
         Called automatically whenever a message is received from the F-Chat websocket. The first three letters will be
         the command given by the message. Everything after it will be the data in JSON form.
         :param m: Message received, UTF-8 encoded, in JSON form.
+        :return: Whatever the handler returned. For async handlers, that's the coroutine to await.
         """
 
         command = m[:3]
-        try:
-            json_string = m[4:]
-            data = json.loads(json_string)
-        except:
-            data = {}
-
-        # Print everything not filtered out by log_filter to the logger.
-        if command not in self.log_filter:
-            self.logger.debug("<< %s %s" % (command, data))
-
         self.last_ping_received = time.time()
 
-        # Call the function for the command. There's probably a better way to do this, but this is at least stable, and
-        # multiple if/else string checks like this are actually not very time intensive in python.
-        if command == "ADL":  # Chatops list
-            self.on_ADL(data['ops'])
-
-        elif command == "AOP":  # Chatops promotion
-            self.on_AOP(data['character'])
-
-        elif command == "BRO":  # Admin broadcast
-            self.on_BRO(data['message'])
-
-        elif command == "CDS":  # Channel description change
-            self.on_CDS(data['channel'], data['description'])
-
-        elif command == "CHA":  # Public channels list
-            self.on_CHA(data['channels'])
-
-        elif command == "CIU":  # Channel invite
-            self.on_CIU(data['sender'], data['title'], data['name'])
-
-        elif command == "CBU":  # User banned from channel
-            self.on_CBU(data['operator'], data['channel'], data['character'])
-
-        elif command == "CKU":  # User kicked from channel
-            self.on_CKU(data['operator'], data['channel'], data['character'])
-
-        elif command == "COA":  # Channel op promotion
-            self.on_COA(data['character'], data['channel'])
-
-        elif command == "COL":  # Channel ops list
-            self.on_COL(data['channel'], data['oplist'])
-
-        elif command == "CON":  # Number of connected users
-            self.on_CON(data['count'])
-
-        elif command == "COR":  # Channel op demotion
-            self.on_COR(data['character'], data['channel'])
-
-        elif command == "CSO":  # Channel owner promotion
-            self.on_CSO(data['character'], data['channel'])
-
-        elif command == "CTU":  # Channel temp ban
-            self.on_CTU(data['operator'], data['channel'], data['length'], data['character'])
-
-        elif command == "DOP":  # Chatops demotion
-            self.on_DOP(data['character'])
-
-        elif command == "ERR":  # Error notification
-            self.on_ERR(data['message'], data['number'])
-
-        elif command == "FKS":  # Search results
-            self.on_FKS(data['characters'], data['kinks'])
-
-        elif command == "FLN":  # User disconnected
-            self.on_FLN(data['character'])
-
-        elif command == "HLO":  # Hello command
-            self.on_HLO(data['message'])
-
-        elif command == "ICH":  # Initial channel data
-            self.on_ICH(data['users'], data['channel'], data['mode'])
-
-        elif command == "IDN":  # Identification successful
-            self.on_IDN(data['character'])
-
-        elif command == "JCH":  # User joined channel
-            self.on_JCH(data['character']['identity'], data['channel'], data['title'])
-
-        elif command == "KID":  # Kink data
-            if data['type'] == 'start' or data['type'] == 'end':
-                self.on_KID(data['type'], data['character'], data['message'])
-            elif data['type'] == 'custom':
-                self.on_KID(data['type'], data['character'], data['key'], data['value'])
-            else:
-                pass
-
-        elif command == "LCH":  # User left channel
-            self.on_LCH(data['channel'], data['character'])
-
-        elif command == "LIS":  # Online characters list
-            self.on_LIS(data['characters'])
-
-        elif command == "NLN":  # User connected
-            self.on_NLN(data['identity'], data['gender'], data['status'])
-
-        elif command == "IGN":  # Ignore list
-            if data['action'] == 'init':
-                self.on_IGN(data['action'], characters=data['characters'])
-            elif data['action'] == 'add' or data['action'] == 'delete':
-                self.on_IGN(data['action'], character=data['character'])
-
-        elif command == "FRL":  # Friends list
-            self.on_FRL(data['characters'])
-
-        elif command == "ORS":  # Private channels list
-            self.on_ORS(data['channels'])
-
-        elif command == "PIN":  # Ping from server
-            self.on_PIN()
-
-        elif command == "PRD":  # Profile data
-            self.on_PRD(data['type'], data['message'], data['key'], data['value'])
-
-        elif command == "PRI":  # Private message
-            self.on_PRI(data['character'], data['message'])
-
-        elif command == "MSG":  # Message in channel
-            self.on_MSG(data['character'], data['message'], data['channel'])
-
-        elif command == "LRP":  # Ad in channel
-            self.on_LRP(data['channel'], data['message'], data['character'])
+        if self.loading_users and command != "LIS":
+            # LIS messages all come in one go, so anything else means we've got every online user.
+            self.finish_loading_users()
+
+        entry = self._dispatch_table.get(command)
+        if not self.lazy_decode:
+            data = _decode_payload(m[4:], self.codec)
+        elif (command in self._unused_commands and command not in self.subscriptions and
+              entry[2] not in self.__dict__) or (command in self._world_commands and not self.owns_presence()):
+            # Nobody listens to this one (or another client sharing our WorldState takes care of it), so there's no
+            # point decoding it.
+            if command == "LIS":
+                self.loading_users = True
+            if command not in self.log_filter and self.logger.isEnabledFor(logging.DEBUG):
+                self.log_frame("<<", command, m[4:])
+            return
+        elif entry is None or entry[0] is _raw_payload:
+            data = LazyPayload(m[4:], self.codec)
+        else:
+            data = _decode_payload(m[4:], self.codec)
 
-        elif command == "RLL":  # Dice roll results
-            if data['type'] == 'dice':
-                self.on_RLL(data['channel'], data['type'], data['character'], data['message'], results=data['results'],
-                            rolls=data['rolls'], endresult=data['endresult'])
-            elif data['type'] == 'bottle':
-                self.on_RLL(data['channel'], data['type'], data['character'], data['message'], target=data['target'])
+        # Print everything not filtered out by log_filter to the logger.
+        if command not in self.log_filter and self.logger.isEnabledFor(logging.DEBUG):
+            self.log_frame("<<", command, m[4:])
+
+        if entry is None:
+            return self.on_unknown_command(command, data)
+
+        extract, handler, handler_name = entry
+        if handler_name in self.__dict__:
+            # Assigned on this instance, which takes over from the class's handler like any other attribute would.
+            handler = _instance_handler(self.__dict__[handler_name])
+        call = extract(data)
+        if call is None:
+            return None
+        if command in self._awaiting and command != "LIS":
+            # LIS comes in many parts, so it's checked off in finish_loading_users() instead.
+            result = self._handle(handler, command, data, call[0], call[1])
+            self.data_arrived(command)
+            return result
+        if self.handler_pool is not None and (command in self._pooled_commands or
+                                              (command in PASSIVE_COMMANDS and command in self.subscriptions)):
+            if not self.handler_pool.submit(self.conversation_key(command, data), handler_name, self._run_pooled,
+                                            handler, command, data, call[0], call[1]):
+                self.logger.warning("Handler pool is full, dropped %s message.", command)
+            return None
+        return self._handle(handler, command, data, call[0], call[1])
+
+    def _handle(self, handler, command, data, args, kwargs):
+        # Calls the on_XXX handler, then any subscribed handlers that match.
+        result = handler(self, *args, **kwargs)
+        if command in self.subscriptions:
+            pending = self.subscriptions.dispatch(command, data, args, kwargs)
+            if pending:
+                return _await_all(result, pending)
+        return result
+
+    def _run_pooled(self, handler, command, data, args, kwargs):
+        # Runs on one of handler_pool's threads.
+        self._handle(handler, command, data, args, kwargs)
+
+    def subscribe(self, command, handler=None, channel=None, character=None, predicate=None):
+        """
+        Calls a handler for some of the messages with a command, on top of its on_XXX handler. Only the handlers that
+        match a message are looked at, so lots of small ones cost next to nothing. Subscriptions last until cancelled,
+        across reconnects, so subscribe once (Ex: in __init__) rather than in a hook like on_ready() that runs every time
+        we connect. Can also be used as a decorator.
+        Ex: self.subscribe("MSG", self.greet, channel="Frontpage", predicate=lambda character, message, channel:
+        message.startswith("!hello"))
+        :param command: The three letter command. Ex: "MSG"
+        :param handler: Function called with the same arguments as on_XXX, minus self. May be a coroutine with
+        AsyncFChatClient.
+        :param channel: Only call it for messages in this channel (by ID). Default is any channel.
+        :param character: Only call it for messages from, or about, this character. Default is any character.
+        :param predicate: Function given the same arguments as handler, which returns whether to call handler.
+        :return: Subscription object, whose cancel() unsubscribes. When used as a decorator, the function itself.
+        """
+        if command not in COMMANDS:
+            raise ValueError("Unknown command: %s" % command)
+        if handler is None:
+            def decorator(function):
+                self.subscriptions.subscribe(command, function, channel, character, predicate)
+                return function
+            return decorator
+        return self.subscriptions.subscribe(command, handler, channel, character, predicate)
+
+    def call_later(self, delay, function, *args):
+        """
+        Runs a job once, after a delay. Ex: self.call_later(60, self.STA, "online", "Back!")
+        :param delay: Number of seconds to wait.
+        :param function: Function to call.
+        :return: Timer object. Call its cancel() to stop the job.
+        """
+        return self.scheduler.call_later(delay, self.run_job, function, args)
+
+    def call_every(self, interval, function, *args):
+        """
+        Runs a job over and over, such as rotating ads. Ex: self.call_every(600, self.post_ads)
+        :param interval: Number of seconds between runs. The first run is one interval from now.
+        :param function: Function to call.
+        :return: Timer object. Call its cancel() to stop the job.
+        """
+        return self.scheduler.call_every(interval, self.run_job, function, args)
+
+    def run_job(self, function, args):
+        """
+        Runs a job scheduled with call_later() or call_every(). By default, that's right on the scheduler's thread, which
+        every client shares, so jobs should be quick. Queueing messages is fine; fetching web pages isn't.
+        """
+        function(*args)
+
+    def conversation_key(self, command, data):
+        """
+        Decides which pooled handlers must run in order. Messages with the same key are handled one at a time, in the
+        order they arrived. By default, that's everything in the same channel, or from the same character.
+        :param command: The three letter command.
+        :param data: The message's data.
+        :return: Any hashable value.
+        """
+        channel = data.get('channel')
+        if channel:
+            return "channel", channel.lower()
+        character = data.get('character')
+        if character:
+            return "character", character.lower()
+        return "command", command
+
+    @property
+    def message_delay(self):
+        """
+        Number of seconds to wait between chat messages (MSG, PRI and RLL). Set automatically from the server's
+        msg_flood variable. Other kinds of messages have their own limits; see rate_limiter.
+        """
+        return self.rate_limiter.intervals["chat"]
+
+    @message_delay.setter
+    def message_delay(self, delay):
+        self.rate_limiter.configure("chat", delay)
+        self.outgoing_buffer.wake()
 
-        elif command == "RMO":  # Room ad mode changed
-            self.on_RMO(data['mode'], data['channel'])
+    def send_message(self, cmd, data):
+        """
+        Despite the name, this doesn't immediately send out a message. Instead, it adds a message to be sent to the
+        websocket to a queue. Queued messages are sent out by send_ready() as fast as the flood limits allow.
+        :param cmd: The command to be given out, in the form of a string. Ex: "PRI"
+        :param data: The data for the message in dict form. Ex: {"message": "Hello, world!", "recipient": "John Doe"}
+        :return: True if the message was queued, False if it was dropped because too many similar messages are waiting.
+        """
+        if self.outgoing_buffer.put(cmd, data):
+            return True
+        self.logger.warning("Outgoing queue is full, dropped %s message.", cmd)
+        return False
 
-        elif command == "RTB":  # Real-time bridge
-            if data['type'] in ["trackadd", "trackrem", "friendadd", "friendremove", "friendrequest"]:
-                self.on_RTB(data['type'], name=data['name'])
-            elif data['type'] == 'note':
-                self.on_RTB(data['type'], sender=data['sender'], note_id=data['id'], subject=data['subject'])
+    def format_frame(self, cmd, data):
+        """
+        Turns a queued message into the text to write to the websocket, logging it on the way.
+        :param cmd: The three letter command.
+        :param data: The data for the message in dict form.
+        :return: The message in string form. Ex: 'PRI {"recipient":"John Doe","message":"Hello, world!"}'
+        """
+        data = self.codec.dumps(data)
+        # Logs every outgoing message except pings (unless otherwise specified).
+        if ((cmd != "PIN") or self.log_pings) and self.logger.isEnabledFor(logging.DEBUG):
+            self.log_frame(">>", cmd, data)
+        return cmd + " " + data
 
-        elif command == "SFC":  # Alert admins and chatops
-            self.on_SFC(data)  # TODO: Add more inputs
+    def finish_loading_users(self):
+        """
+        Called once the server is done sending us the list of online users.
+        """
+        self.loading_users = False
+        if not self.users_loaded:
+            self.users_loaded = True
+            self.on_users_loaded()
+            if "LIS" in self._awaiting:
+                self.data_arrived("LIS")
 
-        elif command == "STA":  # User changes status
-            self.on_STA(data['status'], data['character'], data['statusmsg'])
+    def log_frame(self, direction, command, data):
+        """
+        Writes an incoming or outgoing message to the debug log, following log_sampling and log_max_length. Callers
+        should check log_filter and whether the logger is enabled for DEBUG first, so that nothing is done for messages
+        that will never be printed.
+        :param direction: "<<" for incoming messages, ">>" for outgoing ones.
+        :param command: The three letter command.
+        :param data: The message's data, in JSON string form.
+        """
+        every = self.log_sampling.get(command)
+        if every:
+            count = self.log_counts.get(command, 0)
+            self.log_counts[command] = count + 1
+            if count % every:
+                return
 
-        elif command == "SYS":  # Message generated by server
-            if 'channel' in data:
-                self.on_SYS(data['message'], channel=data['channel'])
-            else:
-                self.on_SYS(data['message'])
+        if self.log_max_length and len(data) > self.log_max_length:
+            data = "%s... (%d more characters)" % (data[:self.log_max_length], len(data) - self.log_max_length)
+        self.logger.debug("%s %s %s", direction, command, data)
 
-        elif command == "TPN":  # User typing status
-            self.on_TPN(data['character'], data['status'])
+    def add_user(self, user):
+        self.users.add(user)
 
-        elif command == "UPT":  # Server up-time
-            self.on_UPT(data['time'], data['starttime'], data['startstring'], data['accepted'], data['channels'],
-                        data['users'], data['maxusers'])
+    def remove_user(self, user):
+        """
+        Forgets an online user, including every channel they were in.
+        :param user: The user, as a User object or by name.
+        """
+        name = user if isinstance(user, str) else user.name
+        for channel_id in self.user_channels.pop(name.lower(), ()):
+            self.channels[channel_id].left(name)
 
-        elif command == "VAR":  # Server variables
-            self.on_VAR(data['variable'], data['value'])
+        if self.owns_presence():
+            self.users.remove(name)
 
-    def send_message(self, cmd, data):
+    def add_user_to_channel(self, room, character):
         """
-        Despite the name, this doesn't immediately send out a message. Instead, it adds a message to be sent to the
-        websocket to a queue. This message will be sent out with the send_one() function.
-        :param cmd: The command to be given out, in the form of a string. Ex: "PRI"
-        :param data: The data for the message in dict form. Ex: {"message": "Hello, world!", "recipient": "John Doe"}
+        Adds a character to a channel's member list, and keeps track of which channels they're in.
+        :param room: The channel, as a Channel object.
+        :param character: Name of the character.
         """
-        self.buffer_lock.acquire()
-        self.outgoing_buffer.append((cmd, json.dumps(data)))
-        self.buffer_lock.release()
+        room.joined(self.get_user_by_name(character) or character)
+        self.user_channels.setdefault(character.lower(), set()).add(room.id.lower())
 
-    def send_one(self):
+    def remove_user_from_channel(self, room, character):
         """
-        Used to send the next message in the outgoing_buffer queue to the websocket. This is called in a periodic manner
-        to prevent violation of the websocket's anti-spam timer.
+        Removes a character from a channel's member list. If that character is us, we won't hear about the channel's
+        members anymore, so it gets emptied out entirely.
+        :param room: The channel, as a Channel object.
+        :param character: Name of the character.
         """
-        self.buffer_lock.acquire()
-        cmd, data = self.outgoing_buffer.pop(0)
-        if (cmd != "PIN") or self.log_pings:
-            self.logger.debug(
-                ">> %s %s" % (cmd, data))  # Logs every outgoing message except pings (unless otherwise specified).
-        try:
-            self.send(cmd + " " + data)
-        except AttributeError:
-            pass
-        self.buffer_lock.release()
+        if character.lower() == self.character_name.lower():
+            self.set_channel_users(room, [])
+            room.members_known = False
+            return
 
-    def add_user(self, user):
-        self.users[user.name.lower()] = user
+        room.left(character)
+        channels = self.user_channels.get(character.lower())
+        if channels is not None:
+            channels.discard(room.id.lower())
+            if not channels:
+                del self.user_channels[character.lower()]
 
-    def remove_user(self, user):
+    def set_channel_users(self, room, characters):
+        """
+        Replaces a channel's entire member list.
+        :param room: The channel, as a Channel object.
+        :param characters: Names of every character in the channel.
+        """
+        channel_id = room.id.lower()
+        for name in room.members:
+            channels = self.user_channels.get(name)
+            if channels is not None:
+                channels.discard(channel_id)
+                if not channels:
+                    del self.user_channels[name]
 
-        for channel in self.channels.keys():
-            self.channels[channel].left(user)
+        room.set_characters([self.get_user_by_name(character) or character for character in characters])
+        for name in room.members:
+            self.user_channels.setdefault(name, set()).add(channel_id)
 
-        del self.users[user.name.lower()]
+    def get_user_channels(self, user_name):
+        """
+        Finds every channel we're in that the given character is also in.
+        :param user_name: Name of the character.
+        :return: List of Channel objects.
+        """
+        return [self.channels[channel_id] for channel_id in self.user_channels.get(user_name.lower(), ())]
 
     def user_exists_by_name(self, user_name):
         return user_name.lower() in self.users
 
     def get_user_by_name(self, name):
-        try:
-            return self.users[name.lower()]
-        except KeyError:
-            return None
+        return self.users.get_user(name)
 
     def add_channel(self, channel):
         self.channels[channel.id.lower()] = channel
@@ -418,15 +744,6 @@ class FChatClient(websocket.WebSocketApp):
         except KeyError:
             return None
 
-    def reconnect_stagger(self):
-        self.terminate_threads()
-        self.logger.info("Trying to reconnect in %d seconds (attempt number %d) ..." % (
-            self.reconnect_delay, self.reconnect_attempt))
-        time.sleep(self.reconnect_delay)
-        if self.reconnect_delay < 120:
-            self.reconnect_delay *= 2
-        self.reconnect_attempt += 1
-
     """
     --- EVENT HANDLERS ---
     These functions will be called automatically when they are sent to us from the server. You should never have to call
@@ -439,7 +756,7 @@ class FChatClient(websocket.WebSocketApp):
         Sends the client the current list of chatops.
         :param ops: Array of chat operator names.
         """
-        self.operators = ops
+        self.operators[:] = ops  # Updated in place, since it may be shared through a WorldState.
 
     def on_AOP(self, character):
         """
@@ -511,7 +828,7 @@ class FChatClient(websocket.WebSocketApp):
         """
 
         if self.channel_exists_by_id(channel):
-            self.get_channel_by_id(channel).left(self.get_user_by_name(character))
+            self.remove_user_from_channel(self.get_channel_by_id(channel), character)
         else:
             self.logger.error("Error: Got CKU message from a channel we don't know!")
 
@@ -548,7 +865,7 @@ class FChatClient(websocket.WebSocketApp):
         network.
         :param count: Integer for number of connected users.
         """
-        pass
+        self.expected_users = count
 
     def on_COR(self, character, channel):
         """
@@ -584,7 +901,7 @@ class FChatClient(websocket.WebSocketApp):
         """
 
         if self.channel_exists_by_id(channel):
-            self.get_channel_by_id(channel).left(self.get_user_by_name(character))
+            self.remove_user_from_channel(self.get_channel_by_id(channel), character)
         else:
             self.logger.error("Error: Got CTU message from a channel we don't know!")
 
@@ -617,13 +934,10 @@ class FChatClient(websocket.WebSocketApp):
         :param character: Name of character that went offline.
         """
 
-        user = self.get_user_by_name(character)
-
-        if not user:
-            logging.warning("Error, got FLN for user not in our list: %s" % character)
-            return
+        if self.track_presence and self.owns_presence() and not self.user_exists_by_name(character):
+            self.logger.warning("Error, got FLN for user not in our list: %s", character)
 
-        self.remove_user(user)
+        self.remove_user(character)
 
     def on_HLO(self, message):
         """
@@ -641,12 +955,8 @@ class FChatClient(websocket.WebSocketApp):
         """
 
         room = self.get_channel_by_id(channel)
-        room.num_characters = 0
         room.mode = mode
-
-        for user in users:
-            user = self.get_user_by_name(user['identity'])
-            room.joined(user)
+        self.set_channel_users(room, [user['identity'] for user in users])
 
     def on_IDN(self, character):
         """
@@ -669,7 +979,7 @@ class FChatClient(websocket.WebSocketApp):
             if not self.channel_exists_by_id(channel):
                 self.add_channel(Channel(channel, title, 0))
 
-        self.get_channel_by_id(channel).joined(self.get_user_by_name(character))
+        self.add_user_to_channel(self.get_channel_by_id(channel), character)
 
     def on_KID(self, kid_type, message, character='', key=None, value=None):
         """
@@ -689,16 +999,20 @@ class FChatClient(websocket.WebSocketApp):
         :param character: Name of the character that's left.
         """
 
-        self.get_channel_by_id(channel).left(self.get_user_by_name(character))
+        self.remove_user_from_channel(self.get_channel_by_id(channel), character)
 
     def on_LIS(self, characters):
         """
         Sends an array of all the online characters and their gender, status, and status message.
         :param characters: Array of character arrays with format ["Name", "Gender", "Status", "Status Message"].
         """
+        self.loading_users = True
+        self.users_received += len(characters)
+        if self.owns_presence():
+            self.users.add_many(characters)
 
-        for user in characters:
-            self.add_user(User(user[0], user[1], user[2], user[3]))
+        if self.expected_users and self.users_received >= self.expected_users:
+            self.finish_loading_users()
 
     def on_NLN(self, identity, gender, status):
         """
@@ -708,7 +1022,7 @@ class FChatClient(websocket.WebSocketApp):
         :param status: Enum for status. Should always be "online" since they just joined.
         """
 
-        if not self.user_exists_by_name(identity):
+        if self.owns_presence() and not self.user_exists_by_name(identity):
             self.add_user(User(identity, gender, status, ''))
 
     def on_IGN(self, action, character=None, characters=None):
@@ -826,7 +1140,9 @@ class FChatClient(websocket.WebSocketApp):
         :param note_id: Optional variable for 'note'. Integer ID for the note, used to link to the contents of the note.
         :param subject: Optional variable for 'note'. Subject title for the note received.
         """
-        pass
+        if rtb_type in ("friendadd", "friendremove") and "friends" in self.api_caches:
+            # We can't tell which of the account's characters it was about, so every cached friend list may be stale.
+            self.api_caches["friends"].clear()
 
     def on_SFC(self, data):
         """
@@ -845,9 +1161,8 @@ class FChatClient(websocket.WebSocketApp):
         :param character: Name of the character setting their message.
         :param statusmsg: The custom message set by the character.
         """
-        user = self.get_user_by_name(character)
-        if user:
-            user.update(status, statusmsg)
+        if self.owns_presence():
+            self.users.set_status(character, status, statusmsg)
 
     def on_SYS(self, message, channel=None):
         """
@@ -887,13 +1202,44 @@ class FChatClient(websocket.WebSocketApp):
         """
         self.server_vars[variable] = value
 
-        # fine tune outgoing message pump
-        if variable == 'msg_flood':
-            delay = float(value) * 2.5
-            self.logger.debug("Fine tuned outgoing message delay to %f." % delay)
-            # Increase the value by 150%, just to be safe!
-            # self.outgoing_thread.set_delay(delay)
-            self.message_delay = delay
+        # Fine tune the outgoing flood limits. These get increased a little, just to be safe!
+        delay = self.rate_limiter.configure_from_variable(variable, value)
+        if delay is not None:
+            self.logger.debug("Fine tuned outgoing delay for %s to %f.", variable, delay)
+            self.outgoing_buffer.wake()
+        elif variable == 'chat_max':
+            self.outgoing_buffer.max_lengths["MSG"] = int(value)
+        elif variable == 'priv_max':
+            self.outgoing_buffer.max_lengths["PRI"] = int(value)
+
+    def on_users_loaded(self):
+        """
+        Called once, after connecting, when the full list of online users has arrived and self.users is complete.
+        """
+        pass
+
+    def on_identified(self):
+        """
+        Called once the server has accepted our IDN. Messages like JCH and STA can be sent from here on; chat messages
+        queued now are held until on_ready().
+        """
+        pass
+
+    def on_ready(self):
+        """
+        Called once, after connecting, when the server has sent us everything in ready_after: the online users, chatops,
+        friends and ignores. Everything queued so far goes out now. This is the place to join channels, set a status,
+        and so on.
+        """
+        pass
+
+    def on_unknown_command(self, command, data):
+        """
+        Called for any command the server sends that this library doesn't have a handler for.
+        :param command: The three letter command.
+        :param data: The decoded data of the message, in dict form.
+        """
+        pass
 
     """
     --- CLIENT COMMANDS ---
@@ -1346,66 +1692,91 @@ class FChatClient(websocket.WebSocketApp):
     can be further broken down into useful information. Be careful not to spam these commands!
     """
 
-    @staticmethod
-    def send_JSON_request(url, data=None):
-        if data is None:
-            data = {}
-        data_enc = urllib.parse.urlencode(data)
-        data_enc = data_enc.encode("UTF-8")
-
-        response = urllib.request.urlopen(url, data_enc)
-        return json.loads(response.read().decode("UTF-8"))
+    def send_JSON_request(self, url, data=None, idempotent=True):
+        """
+        Sends a request to one of F-List's JSON endpoints, over http_client's pooled connections. Requests are paced to
+        what F-List can take, and retried if they failed because it's struggling. See Throttle.
+        :param url: Path of the endpoint, relative to http_client's base_url (or a full URL). Ex:
+        '/json/api/character-data.php'
+        :param data: Dictionary of form fields to send.
+        :param idempotent: Set to False if sending the request twice would do something twice, so it's never retried.
+        :return: The decoded reply.
+        :raises CircuitOpenError: If F-List's API looks to be down, and we're not trying it for now.
+        """
+        return self.http_client.post(url, data, idempotent)
 
-    def get_character_profile_data(self, name):
-        return self.send_JSON_request(
-            'https://www.f-list.net/json/api/character-data.php',
-            {
+    def _cached_lookup(self, kind, endpoint, field, name):
+        # Looks a character up through api_caches[kind], if that kind is cached at all.
+        def fetch():
+            return self.send_JSON_request(endpoint, {
                 'account': self.account,
                 'ticket': self.get_ticket(),
-                'name': name
-            }
-        )
+                field: name
+            })
+
+        cache = self.api_caches.get(kind)
+        if cache is None:
+            return fetch()
+        return cache.get(name.lower(), fetch)
+
+    def get_character_profile_data(self, name):
+        return self._cached_lookup("profile", '/json/api/character-data.php', 'name', name)
 
     def get_character_friends(self, name):
-        return self.send_JSON_request(
-            'https://www.f-list.net/json/api/character-friends.php',
-            {
-                'account': self.account,
-                'ticket': self.get_ticket(),
-                'name': name
-            }
-        )
+        return self._cached_lookup("friends", '/json/api/character-friends.php', 'name', name)
 
     def get_character_images(self, name):
-        return self.send_JSON_request(
-            'https://www.f-list.net/json/api/character-images.php',
-            {
-                'account': self.account,
-                'ticket': self.get_ticket(),
-                'name': name
-            }
-        )
+        return self._cached_lookup("images", '/json/api/character-images.php', 'name', name)
 
     def get_character_memo(self, name):
-        return self.send_JSON_request(
-            'https://www.f-list.net/json/api/character-memo-get2.php',
-            {
-                'account': self.account,
-                'ticket': self.get_ticket(),
-                'target': name
-            }
-        )
+        return self._cached_lookup("memo", '/json/api/character-memo-get2.php', 'target', name)
 
     def save_character_memo(self, name, memo):
-        return self.send_JSON_request(
-            'https://www.f-list.net/json/api/character-memo-get2.php',
-            {
-                'account': self.account,
-                'ticket': self.get_ticket(),
-                'target_name': name,
-                'note': memo
-            }
-        )
+        cache = self.api_caches.get("memo")
+        try:
+            return self.send_JSON_request(
+                '/json/api/character-memo-get2.php',
+                {
+                    'account': self.account,
+                    'ticket': self.get_ticket(),
+                    'target_name': name,
+                    'note': memo
+                }
+            )
+        finally:
+            # Only once the write is done: a lookup that ran in the meantime may have cached the old memo.
+            if cache is not None:
+                cache.invalidate(name.lower())
+
+    def fetch_characters(self, names, kind="profile"):
+        """
+        Looks up lots of characters at once, such as everyone in a channel we just joined, batch_workers at a time and
+        no faster than batch_rate per second. Lookups go through the same caches as the single ones.
+        Ex: for name, profile, error in self.fetch_characters(names): ...
+        :param names: Names of the characters. Repeats are only looked up once.
+        :param kind: What to look up: "profile", "images", "friends" or "memo".
+        :return: Generator of (name, result, error) tuples, in the order they finish. error is the exception the lookup
+        raised, in which case result is None.
+        """
+        lookup = {
+            "profile": self.get_character_profile_data,
+            "images": self.get_character_images,
+            "friends": self.get_character_friends,
+            "memo": self.get_character_memo,
+        }[kind]
+        seen = set()
+        unique = []
+        for name in names:
+            if name.lower() not in seen:
+                seen.add(name.lower())
+                unique.append(name)
+        return self.batch_fetcher.map(lookup, unique)
+
+    def api_cache_stats(self):
+        """
+        :return: Hit and miss statistics of each lookup cache. See TTLCache.stats().
+        """
+        return {kind: cache.stats() for kind, cache in self.api_caches.items()}
 
     def get_friend_bookmark_list(self, bookmarklist=False, friendlist=False, requestlist=False, requestpending=False):
         data = {"account": self.account,
@@ -1420,7 +1791,7 @@ class FChatClient(websocket.WebSocketApp):
         if requestpending:
             data['requestpending'] = 'true'
 
-        return self.send_JSON_request('https://www.f-list.net/json/api/friend-list.php', data)
+        return self.send_JSON_request('/json/api/friend-list.php', data)
 
     def get_friend_list(self):
         return self.get_friend_bookmark_list(friendlist=True)['friendlist']
@@ -1436,7 +1807,7 @@ class FChatClient(websocket.WebSocketApp):
 
     def add_bookmark(self, name):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/bookmark-add.php',
+            '/json/api/bookmark-add.php',
             {
                 'account': self.account,
                 'ticket': self.get_ticket(),
@@ -1446,7 +1817,7 @@ class FChatClient(websocket.WebSocketApp):
 
     def remove_bookmark(self, name):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/bookmark-remove.php',
+            '/json/api/bookmark-remove.php',
             {
                 'account': self.account,
                 'ticket': self.get_ticket(),
@@ -1456,7 +1827,7 @@ class FChatClient(websocket.WebSocketApp):
 
     def remove_friend(self, source_name, dest_name):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/friend-remove.php',
+            '/json/api/friend-remove.php',
             {
                 "account": self.account,
                 "ticket": self.get_ticket(),
@@ -1467,47 +1838,286 @@ class FChatClient(websocket.WebSocketApp):
 
     def accept_friend_request(self, request_id):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/request-accept.php',
+            '/json/api/request-accept.php',
             {
                 "account": self.account,
                 "ticket": self.get_ticket(),
                 "request_id": request_id
-            }
+            },
+            idempotent=False
         )
 
     def deny_friend_request(self, request_id):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/request-deny.php',
+            '/json/api/request-deny.php',
             {
                 "account": self.account,
                 "ticket": self.get_ticket(),
                 "request_id": request_id
-            }
+            },
+            idempotent=False
         )
 
     def cancel_friend_request(self, request_id):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/request-cancel.php',
+            '/json/api/request-cancel.php',
             {
                 "account": self.account,
                 "ticket": self.get_ticket(),
                 "request_id": request_id
-            }
+            },
+            idempotent=False
         )
 
     def send_friend_request(self, source, target):
         return self.send_JSON_request(
-            'https://www.f-list.net/json/api/request-send2.php',
+            '/json/api/request-send2.php',
             {
                 "account": self.account,
                 "ticket": self.get_ticket(),
                 "source": source,
                 "target": target
-            }
+            },
+            idempotent=False
+        )
+
+
+FChatProtocol._build_dispatch_table()
+
+
+class FChatClient(FChatProtocol, websocket.WebSocketApp):
+    """
+    A websocket client that connects to the F-Chat websocket and handles messages coming to/from it. Reading is done on
+    a thread of its own. Keeping the connection alive and pacing messages are timers on a Scheduler shared with every
+    other client, and the writes themselves happen on a HandlerPool, also shared, so a stalled socket never holds up the
+    scheduler.
+    """
+    sender = None  # HandlerPool that writes to the websocket. None uses default_sender_pool(), shared by every client.
+
+    def __init__(self, account, password, character, url='wss://chat.f-list.net/chat2',
+                 client_name="Python FChat Library", codec=None):
+        """
+        Calling this will initialize a client to connect one character to the F-Chat websocket.
+        :param account: Your account's username.
+        :param password: Your account's password.
+        :param character: The character you want to log in to.
+        :param url: URL of the websocket. Should be 'wss://chat.f-list.net/chat2' by default but can be redirected elsewhere.
+        :param client_name: Default set to "Python FChat Library".
+        :param codec: JSON codec used for messages, either a codec object or one of "orjson", "ujson" or "json". By
+        default, the fastest one installed is used.
+        """
+        websocket.WebSocketApp.__init__(
+            self, url, header=None, on_open=self.on_opened, on_message=self.received_message, on_error=None,
+            on_close=self.on_closed, on_ping=None, on_pong=None, on_cont_message=None, keep_running=None,
+            get_mask_key=None, cookie=None, subprotocols=None, on_data=None, socket=None
         )
+        FChatProtocol.__init__(self, account, password, character, client_name=client_name, codec=codec)
+
+        self.sender = self.sender or default_sender_pool()
+        self._keep_alive_timer = None
+        self._send_timer = None
+        self._send_scheduled = False
+        self._reconnect_timer = None
+        self._stopped = threading.Event()
+        self.outgoing_buffer.add_listener(self._queue_changed)
+
+    def setup(self):
+        """
+        This function should be called before connecting to the websocket. It will get a ticket for connecting, and
+        schedule sending queued messages and keeping the connection alive. It will also initialize some values.
+        :return: True if able to get a ticket, False if unable to get a ticket.
+        """
+
+        if self.get_ticket() is None:
+            return False
+        else:
+            self.outgoing_buffer.open()
+            self._queue_changed()
+
+            # reconnect_delay isn't reset here, or it would never grow between failed attempts. connection_opened()
+            # resets it once we're actually connected.
+            self.last_ping_received = time.time()
+            self._keep_alive_timer = self.scheduler.call_later(self.keepalive_interval, self.keep_alive)
+
+            self.connected = False
+
+            return True
+
+    def _queue_changed(self):
+        # Called whenever a message is queued, from whichever thread queued it, and by the send timer. One pending run
+        # of send_ready() is enough to pick up any number of them.
+        if not self._send_scheduled and not self.outgoing_buffer.closed:
+            self._send_scheduled = True
+            if not self.sender.submit(self, "send_ready", self.send_ready):
+                self._send_scheduled = False
+                self.logger.warning("Sender pool is full or closed; queued messages will wait.")
+
+    def send_ready(self):
+        """
+        Sends every queued message the rate limiter allows right now, then sets a timer for when the next one may go.
+        Runs on one of sender's threads, never more than one at a time for the same client.
+        """
+        self._send_scheduled = False
+        if self._send_timer is not None:
+            self._send_timer.cancel()
+            self._send_timer = None
+
+        while True:
+            frame, wait = self.outgoing_buffer.poll()
+            if frame is None:
+                break
+            if not self.send_frame(*frame):
+                # The connection is gone. connection_opened() sends the rest once there's a new one.
+                return
+        if wait is not None:
+            self._send_timer = self.scheduler.call_later(wait, self._queue_changed)
+
+    def _ready_timed_out(self):
+        # Timers fire on the scheduler's thread, which every client shares, and on_ready() may take a while. So it runs
+        # on a sender thread instead, under its own key so that this client's messages keep going out meanwhile.
+        if not self.sender.submit((self, "ready"), "on_ready", FChatProtocol._ready_timed_out, self):
+            FChatProtocol._ready_timed_out(self)
+
+    def keep_alive(self):
+        """
+        Sends a ping every keepalive_interval seconds, and closes the connection if the server hasn't pinged us in
+        keepalive_timeout seconds. Runs on the scheduler's thread, and schedules itself for whichever of those is due
+        next.
+        """
+        self._keep_alive_timer = None
+        now = time.time()
+        if now - self.last_ping_received > self.keepalive_timeout:
+            self.logger.info("Didn't get a ping in time. Restarting.")
+            # Closing waits for the server to answer, so it's done on a sender thread, after anything still being sent.
+            self.sender.submit(self, "close", self.close, reason="%g seconds since last ping." % self.keepalive_timeout)
+            return
+
+        if now - self.last_ping_sent > self.keepalive_interval and self.state != "disconnected":
+            self.PIN()
+        due = min(self.last_ping_sent + self.keepalive_interval,
+                  self.last_ping_received + self.keepalive_timeout)
+        self._keep_alive_timer = self.scheduler.call_later(max(due - time.time(), 0) + 0.01, self.keep_alive)
+
+    def terminate_threads(self):
+        """
+        This function should be called whenever we close our client. It stops sending messages and pinging the server.
+        """
+        self.outgoing_buffer.close()
+        for timer in (self._keep_alive_timer, self._send_timer):
+            if timer is not None:
+                timer.cancel()
+        self._keep_alive_timer = None
+        self._send_timer = None
+
+    def on_opened(self, ws):
+        """
+        Automatically called when we successfully connect to the server. Resets reconnect delays, and sends sends an
+        IDN message.
+        """
+        self.connection_opened()
+
+    def on_closed(self, ws, code, reason=None):
+        """
+        Automatically  called when the client is closed. Terminates threads and logs reason for closing.
+        :param code:
+        :param reason:
+        """
+        self.logger.info("Closing (" + str(code) + ", " + str(reason) + ")!")
+        self.connection_closed()
+        self.terminate_threads()
+
+    def send_one(self):
+        """
+        Used to send the next message in the outgoing_buffer queue to the websocket. This is called in a periodic manner
+        to prevent violation of the websocket's anti-spam timer.
+        :return: True if a message was sent, False if the queue was empty.
+        """
+        frame = self.outgoing_buffer.get(block=False)
+        if frame is None:
+            return False
+        return self.send_frame(*frame)
+
+    def send_frame(self, cmd, data):
+        """
+        Writes a single message to the websocket right away. No locks are held while doing so, so other threads can keep
+        queueing messages in the meantime. If the connection has closed, the message goes back to the front of the
+        queue instead of being lost, unless it's a ping or IDN, which the next connection sends afresh.
+        :param cmd: The three letter command.
+        :param data: The data for the message in dict form.
+        :return: True if it was sent.
+        """
+        try:
+            self.send(self.format_frame(cmd, data))
+        except (AttributeError, websocket.WebSocketConnectionClosedException):
+            self.outgoing_buffer.requeue(cmd, data)
+            return False
+        return True
+
+    def keep_connected(self):
+        """
+        Connects on a thread of its own, and connects again whenever the connection drops or can't be made, after the
+        delay reconnect_stagger() sets. Returns right away. Call wait() to block until stop() is called.
+        """
+        self._stopped.clear()
+        self._connect_in_background()
+
+    def _connect_in_background(self):
+        # Also run by reconnect_stagger()'s timer, on the scheduler's thread, which mustn't block. So connecting (which
+        # fetches a ticket and then reads until the connection closes) gets a thread of its own.
+        self._reconnect_timer = None
+        if not self._stopped.is_set():
+            threading.Thread(target=self._connect, name="%s-connection" % self.character_name).start()
+
+    def _connect(self):
+        try:
+            if self.setup():
+                self.run_forever()
+        except Exception:
+            self.logger.exception("Unknown exception!")
+        if self._stopped.is_set():
+            self.terminate_threads()
+        else:
+            self.reconnect_stagger()
+
+    def stop(self):
+        """
+        Disconnects, and stops keep_connected() from connecting again.
+        """
+        self._stopped.set()
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        self.close()
+        self.terminate_threads()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until stop() is called.
+        :param timeout: Most seconds to wait. Default is forever.
+        :return: True if stopped, False if the timeout ran out first.
+        """
+        return self._stopped.wait(timeout)
+
+    def reconnect_stagger(self):
+        """
+        Connects again after a delay that doubles with every attempt, up to two minutes. The delay is a timer on the
+        scheduler, so no thread sleeps through it, and this returns right away. keep_connected() calls this whenever the
+        connection drops.
+        :return: Timer object for the reconnect. Call its cancel() to not reconnect after all.
+        """
+        self.terminate_threads()
+        self.logger.info("Trying to reconnect in %d seconds (attempt number %d) ..." % (
+            self.reconnect_delay, self.reconnect_attempt))
+        self._reconnect_timer = self.scheduler.call_later(self.reconnect_delay, self._connect_in_background)
+        if self.reconnect_delay < 120:
+            self.reconnect_delay *= 2
+        self.reconnect_attempt += 1
+        return self._reconnect_timer
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
     with open('credentials.json', "r") as json_file:
         credentials = json.load(json_file)
 
@@ -1516,21 +2126,11 @@ if __name__ == "__main__":
         password=credentials['password'],
         character=credentials['default_character']
     )
-
-    running = True
-
-    while running:
-        try:
-            test.setup()
-            test.log_filter = ["NLN", "FLN", "LCH", "STA", "LIS"]
-            test.run_forever()
-        except KeyboardInterrupt or SystemExit:
-            test.logger.exception("Disconnected by user.")
-            running = False
-        except Exception:
-            test.logger.exception("Unknown exception!")
-            test.terminate_threads()
-            running = False
-        finally:
-            if running and test:
-                test.reconnect_stagger()
+    test.log_filter = ["NLN", "FLN", "LCH", "STA", "LIS"]
+
+    test.keep_connected()
+    try:
+        test.wait()
+    except KeyboardInterrupt:
+        test.logger.info("Disconnected by user.")
+        test.stop()
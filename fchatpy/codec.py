@@ -0,0 +1,144 @@
+import json
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Maps every digit to "0" and everything else to a space, so a run of digits can be found with a plain substring search.
+_DIGIT_RUNS = bytes(0x30 if 0x30 <= byte <= 0x39 else 0x20 for byte in range(256))
+# Integers with fewer digits than this always fit in 64 bits.
+_LONG_NUMBER = b"0" * 19
+
+
+def _has_non_finite(data):
+    """
+    :return: Whether there's a NaN or infinite float anywhere in the data.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(value) for value in data)
+    return False
+
+
+class JSONCodec(object):
+    """
+    Turns F-Chat message data into JSON and back, using the json module from the standard library. Every codec writes
+    compact JSON without escaping non-ASCII characters, and hands anything it can't treat the way json does (integers
+    too big for 64 bits, lone surrogates, NaN) to json instead. So all of them decode the same data from the same text,
+    and write the same text for the same data, except that floats may be written differently. Ex: 1e16 rather than
+    1e+16.
+    """
+    name = "json"
+
+    def loads(self, text):
+        """
+        :param text: JSON in string (or UTF-8 bytes) form.
+        :return: The decoded data.
+        """
+        return json.loads(text)
+
+    def dumps(self, data):
+        """
+        :param data: Data to encode, usually a dict.
+        :return: The data as a JSON string.
+        """
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class OrjsonCodec(JSONCodec):
+    """
+    Codec backed by orjson, the fastest of the bunch. Requires the orjson package.
+    """
+    name = "orjson"
+
+    def loads(self, text):
+        try:
+            if isinstance(text, str):
+                text = text.encode("UTF-8")
+            # orjson reads integers too big for 64 bits as floats, rather than failing.
+            if _LONG_NUMBER not in text.translate(_DIGIT_RUNS):
+                return orjson.loads(text)
+        except (UnicodeEncodeError, orjson.JSONDecodeError):
+            pass  # Lone surrogates, NaN and the like, which json accepts.
+        return json.loads(text)
+
+    def dumps(self, data):
+        try:
+            text = orjson.dumps(data)
+        except TypeError:
+            # Integers too big for 64 bits, lone surrogates, and keys that aren't strings.
+            return JSONCodec.dumps(self, data)
+        if b"null" in text and _has_non_finite(data):
+            # orjson writes NaN and infinity as null.
+            return JSONCodec.dumps(self, data)
+        return text.decode("UTF-8")
+
+
+class UjsonCodec(JSONCodec):
+    """
+    Codec backed by ujson. Requires the ujson package.
+    """
+    name = "ujson"
+
+    def loads(self, text):
+        try:
+            return ujson.loads(text)
+        except (ValueError, OverflowError):
+            # Integers too big for 64 bits, NaN and the like, which json accepts.
+            return json.loads(text)
+
+    def dumps(self, data):
+        try:
+            return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False)
+        except (ValueError, TypeError, OverflowError):
+            # Integers too big for 64 bits, lone surrogates, NaN and the like, which json can still write.
+            return JSONCodec.dumps(self, data)
+
+
+CODECS = {
+    JSONCodec.name: JSONCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+}
+
+
+def available_codecs():
+    """
+    :return: Names of every codec that can be used with the packages currently installed, fastest first.
+    """
+    names = []
+    if orjson is not None:
+        names.append(OrjsonCodec.name)
+    if ujson is not None:
+        names.append(UjsonCodec.name)
+    names.append(JSONCodec.name)
+    return names
+
+
+def get_codec(codec=None):
+    """
+    Picks a codec to use.
+    :param codec: Either a codec object (returned as is), the name of a codec ("orjson", "ujson" or "json"), or None to
+    pick the fastest one installed.
+    :return: A codec object.
+    """
+    if codec is None:
+        return _default_codec
+    if isinstance(codec, str):
+        if codec not in available_codecs():
+            raise ValueError("JSON codec '%s' is not available." % codec)
+        return CODECS[codec]()
+    return codec
+
+
+_default_codec = CODECS[available_codecs()[0]]()
@@ -0,0 +1,151 @@
+import collections
+import logging
+import threading
+import time
+
+
+class HandlerPool(object):
+    """
+    Runs event handlers on a fixed number of worker threads, so a slow handler doesn't hold up reading from the socket.
+    Handlers submitted with the same key (a channel, or the other side of a private conversation) run one at a time, in
+    the order they were submitted. Handlers with different keys run in parallel.
+    A watchdog logs a warning for any handler that's been running longer than slow_after seconds, and counts offenders
+    in slow_handlers.
+    """
+    logger = logging.getLogger("fchat")
+
+    def __init__(self, workers=4, max_pending=1000, slow_after=5.0, name="handler"):
+        """
+        :param workers: Number of worker threads.
+        :param max_pending: Most handlers that may be waiting to run at once. Past that, submit() refuses new ones.
+        :param slow_after: Number of seconds a handler may run before the watchdog reports it. None turns it off.
+        :param name: Prefix for the worker threads' names.
+        """
+        self.max_pending = max_pending
+        self.slow_after = slow_after
+        self.slow_handlers = collections.Counter()  # Number of slow runs of each handler, by description.
+        self.pending = 0
+        self._queues = {}  # Handlers waiting to run, one deque for each key that has any (or that's running).
+        self._ready = collections.deque()  # Keys with a handler that can run now, oldest first.
+        self._running = {}  # (description, key, start time) of the handler each worker is running. Key is the thread.
+        self._reported = set()  # (thread, start time) of running handlers the watchdog already warned about.
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._watch = threading.Condition(self._lock)
+        self.closed = False
+
+        self._threads = [threading.Thread(target=self._worker, name="%s-%d" % (name, number), daemon=True)
+                         for number in range(workers)]
+        if slow_after is not None:
+            self._threads.append(threading.Thread(target=self._watchdog, name="%s-watchdog" % name, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, description, function, *args, **kwargs):
+        """
+        Queues a handler to be run on a worker thread.
+        :param key: Handlers with equal keys run in the order they were submitted, never at the same time.
+        :param description: What to call the handler in watchdog warnings. Ex: "on_PRI"
+        :param function: The function to run.
+        :return: True if queued, False if the pool is full or closed.
+        """
+        with self._lock:
+            if self.closed or self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            queue = self._queues.get(key)
+            if queue is None:
+                # Nothing with this key is waiting or running, so it can go right away.
+                self._queues[key] = collections.deque([(description, function, args, kwargs)])
+                self._ready.append(key)
+                self._work.notify()
+            else:
+                queue.append((description, function, args, kwargs))
+            return True
+
+    def _worker(self):
+        me = threading.current_thread()
+        while True:
+            with self._lock:
+                while not self._ready and not self.closed:
+                    self._work.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                description, function, args, kwargs = self._queues[key][0]
+                started = time.monotonic()
+                self._running[me] = (description, key, started)
+                self._watch.notify()
+
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                self.logger.exception("Exception in %s handler.", description)
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                del self._running[me]
+                if (me, started) in self._reported:
+                    self._reported.discard((me, started))
+                elif self.slow_after is not None and elapsed > self.slow_after:
+                    self.slow_handlers[description] += 1
+                self.pending -= 1
+                queue = self._queues[key]
+                queue.popleft()
+                if queue:
+                    # Back of the line, so one busy conversation can't starve the others.
+                    self._ready.append(key)
+                    self._work.notify()
+                else:
+                    del self._queues[key]
+
+            if self.slow_after is not None and elapsed > self.slow_after:
+                self.logger.warning("%s for %r took %.1f seconds.", description, key, elapsed)
+
+    def _watchdog(self):
+        reported = self._reported
+        with self._lock:
+            while not self.closed:
+                now = time.monotonic()
+                wake_at = None
+                for thread, (description, key, started) in self._running.items():
+                    if (thread, started) in reported:
+                        continue
+                    if now - started > self.slow_after:
+                        reported.add((thread, started))
+                        self.slow_handlers[description] += 1
+                        self.logger.warning("%s for %r has been running for %.1f seconds, holding up everything else "
+                                            "for that conversation.", description, key, now - started)
+                    elif wake_at is None or started + self.slow_after < wake_at:
+                        wake_at = started + self.slow_after
+                # Sleeps until the oldest unreported handler gets slow, or a new one starts.
+                self._watch.wait(None if wake_at is None else wake_at - now + 0.01)
+
+    def close(self):
+        """
+        Stops the workers once everything already queued has run.
+        """
+        with self._lock:
+            self.closed = True
+            self._work.notify_all()
+            self._watch.notify_all()
+
+    def __len__(self):
+        return self.pending
+
+
+_default_sender_pool = None
+_default_lock = threading.Lock()
+
+
+def default_sender_pool():
+    """
+    :return: The HandlerPool that FChatClient writes to its websocket on, shared by every client that isn't given its
+    own. Each client's writes are keyed by the client, so they stay in order, while a client stuck on a stalled socket
+    only ties up one of the workers rather than the scheduler that every client relies on.
+    """
+    global _default_sender_pool
+    with _default_lock:
+        if _default_sender_pool is None:
+            _default_sender_pool = HandlerPool(workers=8, max_pending=100000, slow_after=10, name="fchat-sender")
+        return _default_sender_pool
@@ -0,0 +1,158 @@
+import http.client
+import threading
+import urllib.parse
+
+from fchatpy.codec import get_codec
+from fchatpy.throttle import Throttle
+
+DEFAULT_BASE_URL = 'https://www.f-list.net'
+
+
+class HTTPStatusError(OSError):
+    """
+    Raised when F-List (or whatever base_url points to) answers with an error status.
+    """
+
+    def __init__(self, status, reason, url):
+        super().__init__("HTTP %d %s for %s" % (status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+
+class HTTPClient(object):
+    """
+    Makes requests to F-List's JSON API over persistent, keep-alive connections, so a bot making lots of calls only pays
+    for the TCP and TLS handshakes once per connection instead of once per call. Idle connections are pooled per server
+    and reused by whichever thread needs one next. Requests made with post() go through a Throttle, which adapts how fast
+    they're made to how F-List is coping, retries ones that failed, and stops trying for a while if F-List is down.
+    It's thread-safe, and every client shares default_http_client() unless given its own.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=10, pool_size=8, codec=None, throttle=None):
+        """
+        :param base_url: Where relative paths are sent. Point this at a local stand-in server for testing.
+        :param timeout: Number of seconds to wait for connecting, and for each read, before giving up.
+        :param pool_size: Most idle connections to keep open to each server.
+        :param codec: JSON codec used to decode replies. Default is the fastest one installed.
+        :param throttle: Throttle that post() requests go through. Default has the default settings. False for none.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.codec = get_codec(codec)
+        self.throttle = Throttle() if throttle is None else throttle or None
+        self.connections_opened = 0  # Number of new connections made, ever. Handy for checking reuse.
+        self._idle = {}  # Idle connections to each server, most recently used last. Key is (scheme, host, port).
+        self._lock = threading.Lock()
+
+    def _origin(self, url):
+        if '://' not in url:
+            url = self.base_url + (url if url.startswith('/') else '/' + url)
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        return (parts.scheme, parts.hostname, parts.port), path
+
+    def _connect(self, origin):
+        scheme, host, port = origin
+        self.connections_opened += 1
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _take(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+        return self._connect(origin), False
+
+    def _give_back(self, origin, connection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Makes a request and reads the whole reply.
+        :param method: Ex: "POST"
+        :param url: Either a full URL, or a path relative to base_url. Ex: "/json/api/character-data.php"
+        :param body: Request body, as bytes.
+        :param headers: Dictionary of extra headers.
+        :return: (status, body bytes) tuple.
+        """
+        origin, path = self._origin(url)
+        headers = dict(headers or {})
+        while True:
+            connection, reused = self._take(origin)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The server closed the idle connection while it sat in the pool. Nothing was processed, so it's
+                    # safe to try again on a fresh one.
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._give_back(origin, connection)
+            return response.status, data
+
+    def post(self, url, data=None, idempotent=True):
+        """
+        Sends a form-encoded POST request and decodes the JSON reply, like every F-List JSON endpoint expects.
+        :param url: Either a full URL, or a path relative to base_url. Ex: "/json/api/character-data.php"
+        :param data: Dictionary of form fields.
+        :param idempotent: Whether it's safe to send the request again if it failed. F-List's endpoints are all POST,
+        but most of them only look things up; set this to False for ones that do something that shouldn't happen twice.
+        :return: The decoded reply, usually a dictionary.
+        :raises CircuitOpenError: If F-List looks to be down, and we're not trying it for now.
+        """
+        body = urllib.parse.urlencode(data or {}).encode("UTF-8")
+        if self.throttle is None:
+            return self._post(url, body)
+        return self.throttle.call(self._post, url, body, idempotent=idempotent)
+
+    def _post(self, url, body):
+        status, reply = self.request("POST", url, body, {"Content-Type": "application/x-www-form-urlencoded"})
+        if status >= 400:
+            raise HTTPStatusError(status, http.client.responses.get(status, ''), url)
+        return self.codec.loads(reply.decode("UTF-8"))
+
+    def close(self):
+        """
+        Closes every idle connection. The client can still be used afterwards; it just reconnects.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+_default_http_client = None
+_default_lock = threading.Lock()
+
+
+def default_http_client():
+    """
+    :return: The HTTPClient shared by every client that isn't given its own.
+    """
+    global _default_http_client
+    with _default_lock:
+        if _default_http_client is None:
+            _default_http_client = HTTPClient()
+        return _default_http_client
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import random
+import time
+
+from fchatpy.aio import AsyncFChatClient, websockets
+from fchatpy.ticket import TicketManager
+
+
+class FChatManager(object):
+    """
+    Runs any number of AsyncFChatClient characters, for one or more accounts, on one event loop. Clients on the same
+    account share their tickets, connects are spaced out so we never log in a whole fleet at once, and reconnect delays
+    are jittered so characters that dropped together don't all come back together.
+
+    Ex:
+        manager = FChatManager()
+        for name in ('Character One', 'Character Two'):
+            manager.add(MyBot('username', 'password', name))
+        asyncio.run(manager.run())
+    """
+    logger = logging.getLogger("fchat")
+    connect_interval = 1.0  # Least number of seconds between any two connects, across every character.
+    max_reconnect_delay = 120  # Longest a character waits before reconnecting, in seconds.
+
+    def __init__(self, ticket_manager=None, world=None):
+        """
+        :param ticket_manager: TicketManager shared by every client. A new one is made if not given.
+        :param world: WorldState to attach every client to, so they share one copy of the online users, chatops and
+        server variables. If not given, each client keeps its own.
+        """
+        self.ticket_manager = ticket_manager or TicketManager()
+        self.world = world
+        self.clients = {}  # Every client we run. Key is character name (lower case).
+        self.stats = {}  # Connection history of each client, as reported by health(). Key is character name (lower case).
+        self.running = False
+        self._tasks = {}
+        self._next_connect = 0
+
+    def add(self, client):
+        """
+        Adds a character. If the manager is already running, it's connected right away (well, in its turn).
+        :param client: An AsyncFChatClient (or child class) object.
+        """
+        if not isinstance(client, AsyncFChatClient):
+            raise TypeError("FChatManager can only run AsyncFChatClient objects.")
+        key = client.character_name.lower()
+        if key in self.clients:
+            raise ValueError("Character %s is already being run." % client.character_name)
+        client.ticket_manager = self.ticket_manager
+        if self.world is not None:
+            self.world.attach(client)
+        self.clients[key] = client
+        self.stats[key] = {'connects': 0, 'failures': 0, 'last_connected': None, 'last_error': None, 'state': "idle"}
+        if self.running:
+            self._tasks[key] = asyncio.ensure_future(self._run_client(key, client))
+
+    async def remove(self, character):
+        """
+        Disconnects a character and stops running it.
+        :param character: Name of the character.
+        """
+        key = character.lower()
+        client = self.clients.pop(key, None)
+        self.stats.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if client is not None:
+            await client.stop()
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if client is not None and self.world is not None:
+            self.world.detach(client)
+
+    async def run(self):
+        """
+        Connects every character, and keeps them connected until stop() is called.
+        """
+        AsyncFChatClient._require_websockets()
+        self.running = True
+        for key, client in self.clients.items():
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.ensure_future(self._run_client(key, client))
+        while self.running and self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+            for key, task in list(self._tasks.items()):
+                if task.done():
+                    del self._tasks[key]
+
+    async def stop(self):
+        """
+        Disconnects every character, and makes run() return.
+        """
+        self.running = False
+        await asyncio.gather(*(client.stop() for client in self.clients.values()), return_exceptions=True)
+        # Characters waiting to (re)connect would otherwise sit out their delay first.
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def _wait_for_turn(self):
+        # Hands out connect slots connect_interval seconds apart. Reserving the slot before sleeping keeps this fair
+        # without a lock: everyone who asks gets the next free slot.
+        now = time.monotonic()
+        slot = max(now, self._next_connect)
+        self._next_connect = slot + self.connect_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _run_client(self, key, client):
+        stats = self.stats[key]
+        client.running = True
+        try:
+            while self.running and client.running:
+                stats['state'] = "connecting"
+                await self._wait_for_turn()
+                try:
+                    if await client.setup():
+                        stats['connects'] += 1
+                        stats['last_connected'] = time.time()
+                        stats['state'] = "connected"
+                        await client.run_once()
+                    else:
+                        stats['failures'] += 1
+                        stats['last_error'] = "Couldn't get a ticket."
+                except (OSError, websockets.exceptions.WebSocketException) as e:
+                    self.logger.exception("Connection failed for %s.", client.character_name)
+                    stats['failures'] += 1
+                    stats['last_error'] = repr(e)
+                except Exception as e:
+                    # A bug in a hook shouldn't take the character offline for good; log it and reconnect as usual.
+                    self.logger.exception("Unexpected error for %s.", client.character_name)
+                    stats['failures'] += 1
+                    stats['last_error'] = repr(e)
+
+                if not (self.running and client.running):
+                    break
+                stats['state'] = "waiting"
+                delay = min(client.reconnect_delay, self.max_reconnect_delay)
+                delay = random.uniform(delay / 2, delay)
+                self.logger.info("Reconnecting %s in %.1f seconds (attempt number %d) ..." % (
+                    client.character_name, delay, client.reconnect_attempt))
+                await asyncio.sleep(delay)
+                client.reconnect_delay = min(client.reconnect_delay * 2, self.max_reconnect_delay)
+                client.reconnect_attempt += 1
+        finally:
+            stats['state'] = "stopped"
+
+    def health(self):
+        """
+        Reports how each character is doing.
+        :return: Dictionary keyed by character name, of dictionaries with:
+            state: "idle", "connecting", "connected", "waiting" (to reconnect) or "stopped".
+            readiness: The client's connection state: "disconnected", "connected", "identified" or "ready".
+            identified: True if the server has accepted our IDN on the current connection.
+            users_loaded: True once we've received the list of online users.
+            last_ping: Seconds since the server last pinged us.
+            queued: Number of messages waiting to be sent.
+            connects, failures: Number of successful and failed connection attempts.
+            last_connected: time.time() of the last successful connect, or None.
+            last_error: Description of the last failure, or None.
+            reconnect_attempt: Number of reconnects since we were last connected.
+        """
+        now = time.time()
+        report = {}
+        for key, client in self.clients.items():
+            stats = self.stats[key]
+            report[client.character_name] = dict(
+                stats,
+                readiness=client.state,
+                identified=client.connected,
+                users_loaded=client.users_loaded,
+                last_ping=now - client.last_ping_received,
+                queued=len(client.outgoing_buffer),
+                reconnect_attempt=client.reconnect_attempt,
+            )
+        return report
@@ -0,0 +1,316 @@
+import collections
+import threading
+import time
+
+# Priority classes, most important first. Messages of a more important class always go out before less important ones.
+PRIORITIES = ("control", "state", "chat")
+
+# Priority class of each command. Anything not listed here is "state".
+COMMAND_PRIORITIES = {
+    "PIN": "control",
+    "IDN": "control",
+    "JCH": "state",
+    "LCH": "state",
+    "STA": "state",
+    "MSG": "chat",
+    "PRI": "chat",
+    "LRP": "chat",
+    "RLL": "chat",
+    "TPN": "chat",
+}
+
+# Key naming the data each message replaces, for commands where only the newest unsent one matters.
+SUPERSEDING_COMMANDS = {
+    "STA": lambda data: ("STA",),
+    "TPN": lambda data: ("TPN", data['character'].lower()),
+}
+
+# Commands where sending the same thing twice in a row does nothing, mapped to the command that undoes them.
+IDEMPOTENT_COMMANDS = {
+    "JCH": "LCH",
+    "LCH": "JCH",
+}
+
+# Commands whose consecutive messages to the same target can be merged into one, mapped to the target's key.
+MERGEABLE_COMMANDS = {
+    "MSG": "channel",
+    "PRI": "recipient",
+}
+
+
+class OutgoingQueue(object):
+    """
+    Thread-safe queue of messages waiting to be sent to the server. Adding and taking messages are both O(1), and a
+    thread waiting for messages sleeps until one can actually be sent instead of polling.
+    Messages are split into lanes by priority class and, if given a RateLimiter, by the token bucket they draw from.
+    Messages within a lane stay in order. get() hands out the most important message whose bucket has a token, oldest
+    first, so a ping is never stuck behind chat lines, and a flood-limited chat line never holds up anything else.
+    """
+
+    def __init__(self, limiter=None, limits=None, coalesce=False):
+        """
+        :param limiter: RateLimiter to keep messages within flood limits. None sends everything as fast as possible.
+        :param limits: Dictionary of the most messages of each priority class that may be waiting at once. Ex:
+        {"chat": 1000}. Classes that aren't given have no limit.
+        :param coalesce: If true, redundant messages are combined before they're sent: a new STA or TPN replaces the
+        unsent one, repeated JCH or LCH for a channel are dropped, and back to back MSG or PRI lines to the same target
+        are merged into one message, up to max_lengths.
+        """
+        self.limiter = limiter
+        self.limits = limits or {}
+        self.coalesce = coalesce
+        self.max_lengths = {"MSG": 4096, "PRI": 50000}  # Longest merged message allowed. Set from chat_max/priv_max.
+        self._pending = {}  # Unsent messages that newer ones may replace, for coalescing.
+        self._lanes = {}  # Messages waiting to be sent. Key is (priority, rate limiter bucket key).
+        self._depths = dict.fromkeys(PRIORITIES, 0)  # Number of messages waiting in each priority class.
+        self._count = 0
+        self._seq = 0
+        self._requeued_seq = 0  # Counts down, so messages put back with requeue() go before everything else.
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._allowed = len(PRIORITIES)  # Priority classes at or past this index are held back. See allow().
+        self._listeners = []  # Called whenever waiters should look at the queue again, for waiting outside of threads.
+        self.closed = False
+
+    def put(self, cmd, data):
+        """
+        Adds a message to the end of its lane, and wakes up whoever is waiting for one.
+        :param cmd: The three letter command.
+        :param data: The message's data, in dict form.
+        :return: True if the message was queued, False if its priority class is already full.
+        """
+        priority = COMMAND_PRIORITIES.get(cmd, "state")
+        key = (PRIORITIES.index(priority), self.limiter.key(cmd, data) if self.limiter else None)
+        with self._lock:
+            pending_key = None
+            if self.coalesce:
+                pending_key = self._coalesce(key, cmd, data)
+                if pending_key is True:
+                    return True
+
+            limit = self.limits.get(priority)
+            if limit is not None and self._depths[priority] >= limit:
+                return False
+
+            self._seq += 1
+            entry = [self._seq, cmd, data, pending_key]
+            if pending_key is not None:
+                self._pending[pending_key] = entry
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = collections.deque()
+            lane.append(entry)
+            self._depths[priority] += 1
+            self._count += 1
+            self._ready.notify()
+            self._notify_listeners()
+            return True
+
+    def _coalesce(self, key, cmd, data):
+        """
+        Tries to fold a new message into one that's already waiting. Must be called with the lock held.
+        :return: True if the message was taken care of, otherwise the key to remember it by for later messages (or None).
+        """
+        if cmd in SUPERSEDING_COMMANDS:
+            pending_key = SUPERSEDING_COMMANDS[cmd](data)
+            entry = self._pending.get(pending_key)
+            if entry is not None:
+                entry[2] = data
+                return True
+            return pending_key
+
+        if cmd in IDEMPOTENT_COMMANDS:
+            channel = data['channel'].lower()
+            if (cmd, channel) in self._pending:
+                return True
+            # A JCH after an LCH (or the other way around) isn't redundant, so forget the opposite one.
+            self._pending.pop((IDEMPOTENT_COMMANDS[cmd], channel), None)
+            return cmd, channel
+
+        if cmd in MERGEABLE_COMMANDS:
+            lane = self._lanes.get(key)
+            if lane:
+                last = lane[-1]
+                target = MERGEABLE_COMMANDS[cmd]
+                if last[1] == cmd and last[2][target] == data[target]:
+                    message = last[2]['message'] + "\n" + data['message']
+                    if len(message) <= self.max_lengths[cmd]:
+                        last[2] = dict(last[2], message=message)
+                        return True
+        return None
+
+    def _take(self):
+        """
+        Takes the oldest message that may be sent right now. Must be called with the lock held.
+        :return: A (frame, wait) tuple. frame is (cmd, data), or None if nothing can be sent yet, in which case wait is
+        the number of seconds until something can (None if the queue is empty).
+        """
+        now = time.monotonic()
+        best_key = None
+        best_order = None
+        wake_at = None
+        for key, lane in self._lanes.items():
+            if key[0] >= self._allowed:
+                continue
+            ready_at = self.limiter.ready_at(key[1], now) if self.limiter else now
+            if ready_at <= now:
+                order = (key[0], lane[0][0])
+                if best_order is None or order < best_order:
+                    best_key = key
+                    best_order = order
+            elif wake_at is None or ready_at < wake_at:
+                wake_at = ready_at
+
+        if best_order is None:
+            return None, (None if wake_at is None else wake_at - now)
+
+        lane = self._lanes[best_key]
+        entry = lane.popleft()
+        seq, cmd, data, pending_key = entry
+        if pending_key is not None and self._pending.get(pending_key) is entry:
+            del self._pending[pending_key]
+        if not lane:
+            del self._lanes[best_key]
+        self._depths[PRIORITIES[best_key[0]]] -= 1
+        self._count -= 1
+        if self.limiter:
+            self.limiter.consume(best_key[1], now)
+        return (cmd, data), 0
+
+    def poll(self):
+        """
+        Takes the next message that may be sent, without waiting. For callers that do their own waiting, like an event
+        loop: if nothing comes back, wait at most the returned number of seconds, or until a listener is called.
+        :return: A (frame, wait) tuple. frame is (cmd, data), or None if nothing can be sent yet, in which case wait is
+        the number of seconds until something can (None if the queue is empty or closed).
+        """
+        with self._lock:
+            if self.closed:
+                return None, None
+            return self._take()
+
+    def add_listener(self, callback):
+        """
+        :param callback: Function called with no arguments whenever a message is added, the queue is closed, or wake()
+        is called. It's called with the queue's lock held, from whichever thread did that, so it should only schedule
+        work, never do it. Ex: lambda: loop.call_soon_threadsafe(event.set)
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _notify_listeners(self):
+        for callback in self._listeners:
+            callback()
+
+    def get(self, block=True):
+        """
+        Takes the next message that may be sent.
+        :param block: If true, waits until there's a message that can be sent, or the queue is closed.
+        :return: (cmd, data) tuple, or None if there's no message.
+        """
+        with self._lock:
+            while not self.closed:
+                frame, wait = self._take()
+                if frame is not None or not block:
+                    return frame
+                self._ready.wait(wait)
+            return None
+
+    def allow(self, priority):
+        """
+        Holds back messages of less important classes than the given one until allowed. They stay queued, in order, and
+        go out once a later call allows them. Ex: allow("control") sends nothing but pings and IDN.
+        :param priority: Least important priority class that may be sent. Ex: "chat" to send everything, or None to hold
+        everything back.
+        """
+        with self._lock:
+            self._allowed = 0 if priority is None else PRIORITIES.index(priority) + 1
+            self._ready.notify_all()
+            self._notify_listeners()
+
+    def requeue(self, cmd, data):
+        """
+        Puts back a message that was taken but couldn't be sent, such as when the connection dropped, at the front of
+        the queue. It isn't checked against limits or coalesced, since it was already accepted once. Control messages
+        (pings and IDN) are dropped instead: they only mean something on the connection they were written for, and a new
+        connection sends its own.
+        :param cmd: The three letter command.
+        :param data: The message's data, in dict form.
+        :return: True if the message was put back, False if it was dropped.
+        """
+        priority = COMMAND_PRIORITIES.get(cmd, "state")
+        if priority == "control":
+            return False
+        key = (PRIORITIES.index(priority), self.limiter.key(cmd, data) if self.limiter else None)
+        with self._lock:
+            self._requeued_seq -= 1
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = collections.deque()
+            lane.appendleft([self._requeued_seq, cmd, data, None])
+            self._depths[priority] += 1
+            self._count += 1
+        return True
+
+    def discard(self, priority):
+        """
+        Drops every waiting message of a priority class. Ex: discard("control") before identifying on a new connection,
+        so no ping meant for the old one goes out ahead of IDN.
+        :param priority: Priority class. Ex: "control"
+        :return: Number of messages dropped.
+        """
+        index = PRIORITIES.index(priority)
+        with self._lock:
+            dropped = 0
+            for key in [key for key in self._lanes if key[0] == index]:
+                for entry in self._lanes.pop(key):
+                    if entry[3] is not None and self._pending.get(entry[3]) is entry:
+                        del self._pending[entry[3]]
+                    dropped += 1
+            self._depths[priority] -= dropped
+            self._count -= dropped
+            return dropped
+
+    def wake(self):
+        """
+        Makes waiting threads look at the queue again. Call this after changing the rate limiter's settings.
+        """
+        with self._lock:
+            self._ready.notify_all()
+            self._notify_listeners()
+
+    def close(self):
+        """
+        Wakes up everyone waiting on the queue and makes get() return None from now on. Messages that are already queued
+        are kept, and will be sent once the queue is opened again.
+        """
+        with self._lock:
+            self.closed = True
+            self._ready.notify_all()
+            self._notify_listeners()
+
+    def open(self):
+        """
+        Lets get() hand out messages again after close().
+        """
+        with self._lock:
+            self.closed = False
+
+    def clear(self):
+        with self._lock:
+            self._lanes.clear()
+            self._pending.clear()
+            self._depths = dict.fromkeys(PRIORITIES, 0)
+            self._count = 0
+
+    def depth(self, priority):
+        """
+        :param priority: Priority class. Ex: "chat"
+        :return: Number of messages of that class waiting to be sent.
+        """
+        return self._depths[priority]
+
+    def __len__(self):
+        return self._count
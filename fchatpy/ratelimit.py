@@ -0,0 +1,186 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: one token is added every `interval` seconds, up to `burst` tokens, and every message sent
+    uses one up. With a burst of 1 this simply spaces messages `interval` seconds apart.
+    """
+
+    def __init__(self, interval, burst=1):
+        self.interval = interval
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.interval <= 0:
+            self.tokens = self.burst
+        elif now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+
+    def ready_at(self, now=None):
+        """
+        :param now: Current time.monotonic() value, if you already have it.
+        :return: The time.monotonic() value at which a token will be available. May be in the past.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) * self.interval
+
+    def consume(self, now=None):
+        """
+        Uses up a token. Check ready_at() first; this doesn't wait for one to become available.
+        :param now: Current time.monotonic() value, if you already have it.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+
+    def configure(self, interval, burst=1):
+        self._refill(time.monotonic())
+        self.interval = interval
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+
+class BlockingTokenBucket(TokenBucket):
+    """
+    A TokenBucket that any number of threads can share, with an acquire() that waits for a token. Waiting is done with
+    the lock released, so threads waiting their turn don't hold up configure() or each other.
+    """
+
+    def __init__(self, interval, burst=1):
+        super().__init__(interval, burst)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a token is available, and uses it up.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                ready_at = TokenBucket.ready_at(self, now)
+                if ready_at <= now:
+                    TokenBucket.consume(self, now)
+                    return
+            time.sleep(ready_at - now)
+
+    def ready_at(self, now=None):
+        with self._lock:
+            return super().ready_at(now)
+
+    def consume(self, now=None):
+        with self._lock:
+            super().consume(now)
+
+    def configure(self, interval, burst=1):
+        with self._lock:
+            super().configure(interval, burst)
+
+
+class RateLimiter(object):
+    """
+    Keeps outgoing messages within the server's flood limits, with a separate token bucket for each class of command.
+    Commands that aren't in any class aren't flood limited, and can always be sent right away.
+    """
+
+    # Class of each flood-limited command.
+    COMMAND_CLASSES = {
+        "MSG": "chat",
+        "PRI": "chat",
+        "RLL": "chat",
+        "LRP": "ads",
+    }
+
+    # Classes whose limit applies to each channel separately rather than to everything we send.
+    PER_CHANNEL_CLASSES = frozenset(["ads"])
+
+    # Server variables that set each class's limit, along with how much to multiply them by just to be safe.
+    VARIABLES = {
+        "msg_flood": ("chat", 2.5),
+        "lfrp_flood": ("ads", 1.05),
+    }
+
+    def __init__(self, intervals=None):
+        """
+        :param intervals: Dictionary of the number of seconds to leave between messages of each class. Classes that
+        aren't given start out with a one second interval, until the server tells us better.
+        """
+        self.intervals = {command_class: 1 for command_class in self.COMMAND_CLASSES.values()}
+        if intervals:
+            self.intervals.update(intervals)
+        self.bursts = {}
+        self.buckets = {}
+
+    def key(self, cmd, data):
+        """
+        Works out which bucket a message draws from.
+        :param cmd: The three letter command.
+        :param data: The message's data, in dict form.
+        :return: The bucket's key, or None if the command isn't flood limited.
+        """
+        command_class = self.COMMAND_CLASSES.get(cmd)
+        if command_class in self.PER_CHANNEL_CLASSES:
+            return command_class, data.get('channel', '').lower()
+        return command_class
+
+    def _bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            command_class = key[0] if isinstance(key, tuple) else key
+            bucket = self.buckets[key] = TokenBucket(self.intervals[command_class], self.bursts.get(command_class, 1))
+        return bucket
+
+    def ready_at(self, key, now=None):
+        """
+        :param key: The bucket's key, as returned by key().
+        :param now: Current time.monotonic() value, if you already have it.
+        :return: The time.monotonic() value at which a message from this bucket may be sent.
+        """
+        if key is None:
+            return time.monotonic() if now is None else now
+        return self._bucket(key).ready_at(now)
+
+    def consume(self, key, now=None):
+        """
+        Records that a message from this bucket was just sent.
+        :param key: The bucket's key, as returned by key().
+        :param now: Current time.monotonic() value, if you already have it.
+        """
+        if key is not None:
+            self._bucket(key).consume(now)
+
+    def configure(self, command_class, interval, burst=1):
+        """
+        Changes the limit for a class of commands.
+        :param command_class: Ex: "chat" or "ads".
+        :param interval: Number of seconds to leave between messages.
+        :param burst: Number of messages that may be sent back to back after a quiet period.
+        """
+        self.intervals[command_class] = interval
+        self.bursts[command_class] = burst
+        for key, bucket in self.buckets.items():
+            if key == command_class or (isinstance(key, tuple) and key[0] == command_class):
+                bucket.configure(interval, burst)
+
+    def configure_from_variable(self, variable, value):
+        """
+        Updates limits from a server variable, as sent with VAR.
+        :param variable: Name of the variable.
+        :param value: Value of the variable.
+        :return: The new interval for the class the variable applies to, or None if it isn't about flood limits.
+        """
+        if variable not in self.VARIABLES:
+            return None
+        command_class, factor = self.VARIABLES[variable]
+        interval = float(value) * factor
+        self.configure(command_class, interval, self.bursts.get(command_class, 1))
+        return interval
@@ -0,0 +1,328 @@
+import collections.abc
+import itertools
+import operator
+import sys
+
+from fchatpy.user import User, GENDERS, STATUSES
+
+
+class UserRegistry(dict):
+    """
+    The default way of keeping track of online users: a dictionary of User objects. Key is username (lower case).
+    """
+
+    def add(self, user):
+        """
+        :param user: User object for the character that's now online.
+        """
+        self[user.name.lower()] = user
+
+    def add_many(self, characters):
+        """
+        Adds a whole batch of online characters at once, as sent by LIS.
+        :param characters: Array of character arrays with format ["Name", "Gender", "Status", "Status Message"].
+        """
+        self.update(zip(map(str.lower, map(operator.itemgetter(0), characters)), itertools.starmap(User, characters)))
+
+    def remove(self, name):
+        """
+        :param name: Name of the character that went offline.
+        :return: True if we knew about the character, False if not.
+        """
+        return self.pop(name.lower(), None) is not None
+
+    def get_user(self, name):
+        """
+        :param name: Name of the character.
+        :return: Their User object, or None if they're not online.
+        """
+        return self.get(name.lower())
+
+    def set_status(self, name, status, message):
+        """
+        :param name: Name of the character that changed their status.
+        :param status: Their new status.
+        :param message: Their new status message.
+        :return: True if we knew about the character, False if not.
+        """
+        user = self.get(name.lower())
+        if user is None:
+            return False
+        user.update(status, message)
+        return True
+
+    def count(self, status=None, gender=None):
+        """
+        Counts online users, optionally only those with a certain status and/or gender.
+        :param status: Only count users with this status. Ex: "looking"
+        :param gender: Only count users of this gender. Ex: "Female"
+        :return: Number of matching users.
+        """
+        if status is None and gender is None:
+            return len(self)
+        return sum(1 for user in self.values()
+                   if (status is None or user.status == status) and (gender is None or user.gender == gender))
+
+    def find(self, status=None, gender=None):
+        """
+        Lists online users, optionally only those with a certain status and/or gender.
+        :param status: Only list users with this status. Ex: "looking"
+        :param gender: Only list users of this gender. Ex: "Female"
+        :return: List of character names.
+        """
+        return [user.name for user in self.values()
+                if (status is None or user.status == status) and (gender is None or user.gender == gender)]
+
+
+class ColumnarUser(object):
+    """
+    A live view of one character in a ColumnarUserRegistry. Behaves like a User, but its data lives in the registry.
+    """
+    __slots__ = ('_registry', 'name')
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self.name = name
+
+    def _row(self):
+        return self._registry.rows[self.name.lower()]
+
+    @property
+    def gender(self):
+        return self._registry.genders[self._registry.gender_codes[self._row()]]
+
+    @property
+    def status(self):
+        return self._registry.statuses[self._registry.status_codes[self._row()]]
+
+    @property
+    def message(self):
+        return self._registry.messages.get(self._row(), b'').decode("UTF-8", "surrogatepass")
+
+    def update(self, status, message):
+        self._registry.set_status(self.name, status, message)
+
+    def __repr__(self):
+        return "ColumnarUser(%r)" % self.name
+
+
+class ColumnarUserRegistry(collections.abc.Mapping):
+    """
+    Keeps track of online users column by column instead of one object per user: a name index, one byte each for gender
+    and status, and a side table for the (mostly empty) status messages. It uses a fraction of the memory, and counting
+    or filtering the whole population runs at C speed instead of touching one Python object per user.
+    Use it by setting user_registry = ColumnarUserRegistry in your FChatClient class. Looking a user up returns a
+    ColumnarUser view rather than a User object.
+    """
+
+    def __init__(self):
+        self.rows = {}  # Row number of each user. Key is username (lower case).
+        self.names = []
+        self.gender_codes = bytearray()  # One byte per row, indexing into self.genders.
+        self.status_codes = bytearray()  # One byte per row, indexing into self.statuses.
+        self.messages = {}  # Status message of each row that has one, as UTF-8 bytes (lone surrogates passed through).
+        self.genders = list(GENDERS)
+        self.statuses = list(STATUSES)
+        self._gender_lookup = {gender: code for code, gender in enumerate(self.genders)}
+        self._status_lookup = {status: code for code, status in enumerate(self.statuses)}
+
+    @staticmethod
+    def _code(value, values, lookup):
+        code = lookup.get(value)
+        if code is None:
+            if len(values) > 255:
+                raise ValueError("Too many distinct values to store in a ColumnarUserRegistry: %r" % value)
+            code = lookup[value] = len(values)
+            values.append(sys.intern(value))
+        return code
+
+    def _gender_code(self, gender):
+        return self._code(gender, self.genders, self._gender_lookup)
+
+    def _status_code(self, status):
+        return self._code(status, self.statuses, self._status_lookup)
+
+    def add(self, user):
+        """
+        :param user: User object (or anything with name, gender, status and message) for the character that's online.
+        """
+        self._set(user.name, user.gender, user.status, user.message)
+
+    def add_many(self, characters):
+        """
+        Adds a whole batch of online characters at once, as sent by LIS.
+        :param characters: Array of character arrays with format ["Name", "Gender", "Status", "Status Message"].
+        """
+        names = list(map(operator.itemgetter(0), characters))
+        keys = list(map(str.lower, names))
+        if not self.rows.keys().isdisjoint(keys) or len(set(keys)) != len(keys):
+            # Some of these are already known, so they need updating in place one by one.
+            for character in characters:
+                self._set(*character)
+            return
+
+        start = len(self.names)
+        genders = list(map(self._gender_lookup.get, map(operator.itemgetter(1), characters)))
+        if None in genders:
+            genders = list(map(self._gender_code, map(operator.itemgetter(1), characters)))
+        statuses = list(map(self._status_lookup.get, map(operator.itemgetter(2), characters)))
+        if None in statuses:
+            statuses = list(map(self._status_code, map(operator.itemgetter(2), characters)))
+
+        self.rows.update(zip(keys, range(start, start + len(keys))))
+        self.names.extend(names)
+        self.gender_codes.extend(genders)
+        self.status_codes.extend(statuses)
+        self.messages.update((row, character[3].encode("UTF-8", "surrogatepass"))
+                             for row, character in enumerate(characters, start) if character[3])
+
+    def _set(self, name, gender, status, message):
+        key = name.lower()
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.names)
+            self.names.append(name)
+            self.gender_codes.append(self._gender_code(gender))
+            self.status_codes.append(self._status_code(status))
+        else:
+            self.names[row] = name
+            self.gender_codes[row] = self._gender_code(gender)
+            self.status_codes[row] = self._status_code(status)
+
+        if message:
+            self.messages[row] = message.encode("UTF-8", "surrogatepass")
+        else:
+            self.messages.pop(row, None)
+
+    def remove(self, name):
+        """
+        :param name: Name of the character that went offline.
+        :return: True if we knew about the character, False if not.
+        """
+        row = self.rows.pop(name.lower(), None)
+        if row is None:
+            return False
+
+        # Fill the hole with the last row, so the columns stay packed.
+        last = len(self.names) - 1
+        if row != last:
+            moved = self.names[last]
+            self.rows[moved.lower()] = row
+            self.names[row] = moved
+            self.gender_codes[row] = self.gender_codes[last]
+            self.status_codes[row] = self.status_codes[last]
+            message = self.messages.pop(last, None)
+            if message is None:
+                self.messages.pop(row, None)
+            else:
+                self.messages[row] = message
+        else:
+            self.messages.pop(row, None)
+
+        self.names.pop()
+        self.gender_codes.pop()
+        self.status_codes.pop()
+        return True
+
+    def clear(self):
+        """
+        Forgets every user.
+        """
+        self.rows.clear()
+        del self.names[:]
+        del self.gender_codes[:]
+        del self.status_codes[:]
+        self.messages.clear()
+
+    def get_user(self, name):
+        """
+        :param name: Name of the character.
+        :return: A ColumnarUser view of them, or None if they're not online.
+        """
+        row = self.rows.get(name.lower())
+        if row is None:
+            return None
+        return ColumnarUser(self, self.names[row])
+
+    def set_status(self, name, status, message):
+        """
+        :param name: Name of the character that changed their status.
+        :param status: Their new status.
+        :param message: Their new status message.
+        :return: True if we knew about the character, False if not.
+        """
+        row = self.rows.get(name.lower())
+        if row is None:
+            return False
+        self.status_codes[row] = self._status_code(status)
+        if message:
+            self.messages[row] = message.encode("UTF-8", "surrogatepass")
+        else:
+            self.messages.pop(row, None)
+        return True
+
+    @staticmethod
+    def _mask(codes, lookup, value):
+        # One byte per row: 1 where the column holds the value, 0 elsewhere. bytes.translate() does this in one pass.
+        code = lookup.get(value)
+        if code is None:
+            return bytes(len(codes))
+        table = bytearray(256)
+        table[code] = 1
+        return codes.translate(table)
+
+    def _selectors(self, status, gender):
+        mask = None
+        if status is not None:
+            mask = self._mask(self.status_codes, self._status_lookup, status)
+        if gender is not None:
+            by_gender = self._mask(self.gender_codes, self._gender_lookup, gender)
+            if mask is None:
+                mask = by_gender
+            else:
+                mask = (int.from_bytes(mask, 'big') & int.from_bytes(by_gender, 'big')).to_bytes(len(mask), 'big')
+        return mask
+
+    def count(self, status=None, gender=None):
+        """
+        Counts online users, optionally only those with a certain status and/or gender.
+        :param status: Only count users with this status. Ex: "looking"
+        :param gender: Only count users of this gender. Ex: "Female"
+        :return: Number of matching users.
+        """
+        if status is None and gender is None:
+            return len(self.names)
+        if gender is None:
+            code = self._status_lookup.get(status)
+            return 0 if code is None else self.status_codes.count(code)
+        if status is None:
+            code = self._gender_lookup.get(gender)
+            return 0 if code is None else self.gender_codes.count(code)
+        return self._selectors(status, gender).count(1)
+
+    def find(self, status=None, gender=None):
+        """
+        Lists online users, optionally only those with a certain status and/or gender.
+        :param status: Only list users with this status. Ex: "looking"
+        :param gender: Only list users of this gender. Ex: "Female"
+        :return: List of character names.
+        """
+        if status is None and gender is None:
+            return list(self.names)
+        return list(itertools.compress(self.names, self._selectors(status, gender)))
+
+    def __getitem__(self, key):
+        user = self.get_user(key)
+        if user is None:
+            raise KeyError(key)
+        return user
+
+    def __contains__(self, key):
+        # Names are looked up case-insensitively, the same as with self[key].
+        return isinstance(key, str) and key.lower() in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.names)
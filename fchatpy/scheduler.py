@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Timer(object):
+    """
+    A job scheduled with a Scheduler. Call cancel() to stop it from running (again).
+    """
+    __slots__ = ('scheduler', 'when', 'interval', 'function', 'args', 'cancelled', 'queued')
+
+    def __init__(self, scheduler, when, interval, function, args):
+        self.scheduler = scheduler
+        self.when = when  # time.monotonic() value at which it's due.
+        self.interval = interval  # Seconds between runs for repeating jobs, None for one-off ones.
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.queued = False  # True while it's in the scheduler's heap.
+
+    def cancel(self):
+        self.scheduler._cancel(self)
+
+    def __repr__(self):
+        return "Timer(%r, due in %.2fs)" % (self.function, self.when - time.monotonic())
+
+
+class Scheduler(object):
+    """
+    Runs jobs at given times on a single thread, using a heap of timers. The thread sleeps until the next job is due,
+    or until an earlier one is added, so any number of idle clients cost no wakeups at all apart from their own jobs.
+    Jobs run one at a time, on the scheduler's thread, so they should be quick; hand anything slow off to another thread.
+    Every client shares default_scheduler() unless given its own.
+    """
+    logger = logging.getLogger("fchat")
+
+    def __init__(self, name="fchat-scheduler"):
+        """
+        :param name: Name of the scheduler's thread.
+        """
+        self.name = name
+        self._heap = []  # (when, sequence number, Timer) for every job that's waiting.
+        self._sequence = itertools.count()  # Keeps jobs due at the same time in the order they were added.
+        self._cancelled = 0  # Cancelled jobs still in the heap.
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._thread = None
+        self.closed = False
+
+    def call_at(self, when, function, *args):
+        """
+        :param when: time.monotonic() value at which to run the job.
+        :param function: Function to call.
+        :return: Timer object, to cancel the job with.
+        """
+        timer = Timer(self, when, None, function, args)
+        self._push(timer)
+        return timer
+
+    def call_later(self, delay, function, *args):
+        """
+        :param delay: Number of seconds from now at which to run the job.
+        :param function: Function to call.
+        :return: Timer object, to cancel the job with.
+        """
+        return self.call_at(time.monotonic() + delay, function, *args)
+
+    def call_soon(self, function, *args):
+        return self.call_at(time.monotonic(), function, *args)
+
+    def call_every(self, interval, function, *args, delay=None):
+        """
+        Runs a job over and over until it's cancelled. If a run is late, the missed runs are skipped rather than all
+        being made up at once.
+        :param interval: Number of seconds between runs.
+        :param function: Function to call.
+        :param delay: Number of seconds until the first run. Default is one interval.
+        :return: Timer object, to cancel the job with.
+        """
+        timer = Timer(self, time.monotonic() + (interval if delay is None else delay), interval, function, args)
+        self._push(timer)
+        return timer
+
+    def _push(self, timer):
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Scheduler is closed.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (timer.when, next(self._sequence), timer))
+            timer.queued = True
+            # Only worth waking the thread if this is now the first job due.
+            if self._heap[0][2] is timer:
+                self._changed.notify()
+
+    def _cancel(self, timer):
+        with self._lock:
+            if timer.cancelled:
+                return
+            timer.cancelled = True
+            if not timer.queued:
+                return
+            self._cancelled += 1
+            # Cancelled jobs are normally just skipped when they come up, but don't let them pile up.
+            if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _next(self):
+        # Waits for the next job that's due and takes it off the heap. Returns None once closed.
+        with self._lock:
+            while not self.closed:
+                if not self._heap:
+                    self._changed.wait()
+                    continue
+                when, sequence, timer = self._heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self._heap)
+                    timer.queued = False
+                    self._cancelled -= 1
+                    continue
+                wait = when - time.monotonic()
+                if wait > 0:
+                    self._changed.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                timer.queued = False
+                return timer
+            return None
+
+    def _run(self):
+        while True:
+            timer = self._next()
+            if timer is None:
+                return
+            try:
+                timer.function(*timer.args)
+            except Exception:
+                self.logger.exception("Exception in scheduled job %r.", timer.function)
+
+            if timer.interval is not None and not timer.cancelled:
+                timer.when = max(timer.when + timer.interval, time.monotonic())
+                with self._lock:
+                    if not self.closed and not timer.cancelled:
+                        heapq.heappush(self._heap, (timer.when, next(self._sequence), timer))
+                        timer.queued = True
+
+    def close(self):
+        """
+        Stops the scheduler's thread. Jobs that haven't run yet never will.
+        """
+        with self._lock:
+            self.closed = True
+            self._changed.notify_all()
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """
+    :return: The Scheduler shared by every client that isn't given its own. Its thread only starts once it has a job.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
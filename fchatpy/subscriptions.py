@@ -0,0 +1,183 @@
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+
+# Payload field that names the character each command is about, where it isn't simply 'character'.
+CHARACTER_FIELDS = {
+    "NLN": "identity",
+}
+
+
+def _character_of(command, data):
+    character = data.get(CHARACTER_FIELDS.get(command, 'character'))
+    if isinstance(character, dict):
+        # JCH sends {"identity": name} instead of the name.
+        character = character.get('identity')
+    return character
+
+
+class Subscription(object):
+    """
+    A handler subscribed with SubscriptionRegistry.subscribe(). Call cancel() to unsubscribe it.
+    """
+    __slots__ = ('registry', 'sequence', 'command', 'handler', 'channel', 'character', 'predicate', 'cancelled')
+
+    def __init__(self, registry, sequence, command, handler, channel, character, predicate):
+        self.registry = registry
+        self.sequence = sequence  # Handlers run in the order they were subscribed.
+        self.command = command
+        self.handler = handler
+        self.channel = channel  # Lower case, or None for any.
+        self.character = character  # Lower case, or None for any.
+        self.predicate = predicate
+        self.cancelled = False
+
+    def cancel(self):
+        self.registry.unsubscribe(self)
+
+    def __lt__(self, other):
+        return self.sequence < other.sequence
+
+    def __repr__(self):
+        return "Subscription(%s, %r, channel=%r, character=%r)" % (self.command, self.handler, self.channel,
+                                                                    self.character)
+
+
+class SubscriptionRegistry(object):
+    """
+    Handlers for incoming commands, indexed by command, channel and character. A message only looks at the handlers
+    subscribed to its command and to its own channel or character (plus those that take any), so a bot with a rule for
+    each of 200 channels runs one rule per message rather than 200.
+    Subscribing and unsubscribing may happen from any thread, even while messages are being dispatched: each index list
+    is replaced rather than changed in place, so dispatch never needs the lock.
+    """
+    logger = logging.getLogger("fchat")
+
+    def __init__(self):
+        # For each command, a tuple of three indexes: subscriptions that take any message, those for one channel (keyed
+        # by channel), and those for one character but any channel (keyed by character). Each list is in subscription
+        # order. A subscription for a channel and a character is indexed by channel, and checks the character itself.
+        self._index = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def subscribe(self, command, handler, channel=None, character=None, predicate=None):
+        """
+        :param command: The three letter command. Ex: "MSG"
+        :param handler: Function called with the same arguments as the command's on_XXX handler, minus self.
+        :param channel: Only call it for messages in this channel (by ID). Default is any channel.
+        :param character: Only call it for messages from, or about, this character. Default is any character.
+        :param predicate: Function given the same arguments as handler, which returns whether to call handler.
+        :return: Subscription object. Call its cancel() to unsubscribe.
+        """
+        subscription = Subscription(self, next(self._sequence), command, handler,
+                                    channel.lower() if channel is not None else None,
+                                    character.lower() if character is not None else None, predicate)
+        with self._lock:
+            everything, by_channel, by_character = self._index.get(command, ((), {}, {}))
+            if subscription.channel is not None:
+                by_channel = dict(by_channel)
+                by_channel[subscription.channel] = by_channel.get(subscription.channel, ()) + (subscription,)
+            elif subscription.character is not None:
+                by_character = dict(by_character)
+                by_character[subscription.character] = by_character.get(subscription.character, ()) + (subscription,)
+            else:
+                everything = everything + (subscription,)
+            self._index[command] = (everything, by_channel, by_character)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        :param subscription: Subscription object, as returned by subscribe().
+        """
+        with self._lock:
+            subscription.cancelled = True
+            entry = self._index.get(subscription.command)
+            if entry is None:
+                return
+            everything, by_channel, by_character = entry
+            if subscription.channel is not None:
+                by_channel = self._without(by_channel, subscription.channel, subscription)
+            elif subscription.character is not None:
+                by_character = self._without(by_character, subscription.character, subscription)
+            else:
+                everything = tuple(s for s in everything if s is not subscription)
+            if everything or by_channel or by_character:
+                self._index[subscription.command] = (everything, by_channel, by_character)
+            else:
+                del self._index[subscription.command]
+
+    @staticmethod
+    def _without(index, key, subscription):
+        index = dict(index)
+        remaining = tuple(s for s in index.get(key, ()) if s is not subscription)
+        if remaining:
+            index[key] = remaining
+        else:
+            index.pop(key, None)
+        return index
+
+    def __contains__(self, command):
+        """
+        :return: Whether anything is subscribed to the command.
+        """
+        return command in self._index
+
+    def __len__(self):
+        return sum(len(everything) + sum(map(len, by_channel.values())) + sum(map(len, by_character.values()))
+                   for everything, by_channel, by_character in self._index.values())
+
+    def matching(self, command, data):
+        """
+        :param command: The three letter command.
+        :param data: The message's data.
+        :return: List of the subscriptions whose command, channel and character match the message, in the order they
+        were subscribed. Predicates aren't checked.
+        """
+        entry = self._index.get(command)
+        if entry is None:
+            return []
+        everything, by_channel, by_character = entry
+        candidates = [everything] if everything else []
+        character = None
+        if by_channel:
+            channel = data.get('channel')
+            if channel:
+                candidates.append(by_channel.get(channel.lower(), ()))
+        if by_channel or by_character:
+            character = _character_of(command, data)
+            if character:
+                character = character.lower()
+                if by_character:
+                    candidates.append(by_character.get(character, ()))
+        if len(candidates) == 1:
+            matches = candidates[0]
+        else:
+            matches = heapq.merge(*candidates)
+        return [s for s in matches if s.character is None or s.character == character]
+
+    def dispatch(self, command, data, args, kwargs):
+        """
+        Calls every matching handler. If one raises an exception, it's logged, and the rest are still called.
+        :param command: The three letter command.
+        :param data: The message's data.
+        :param args: Positional arguments for the handlers.
+        :param kwargs: Keyword arguments for the handlers.
+        :return: List of what the handlers that are coroutines returned, to be awaited.
+        """
+        pending = []
+        for subscription in self.matching(command, data):
+            if subscription.cancelled:
+                continue
+            try:
+                if subscription.predicate is not None and not subscription.predicate(*args, **kwargs):
+                    continue
+                result = subscription.handler(*args, **kwargs)
+            except Exception:
+                self.logger.exception("Exception in %s handler %r.", command, subscription.handler)
+                continue
+            if inspect.isawaitable(result):
+                pending.append(result)
+        return pending
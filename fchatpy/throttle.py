@@ -0,0 +1,264 @@
+import http.client
+import logging
+import random
+import threading
+import time
+
+from fchatpy.ratelimit import BlockingTokenBucket
+
+
+class CircuitOpenError(OSError):
+    """
+    Raised instead of making a request while the circuit breaker is open, i.e. while F-List looks to be down.
+    """
+
+    def __init__(self, retry_in):
+        super().__init__("F-List's API looks to be down; not trying again for %.1f seconds." % retry_in)
+        self.retry_in = retry_in
+
+
+def is_overload(error):
+    """
+    :param error: Exception raised by a request.
+    :return: Whether it's a sign that F-List is struggling (throttling us, erroring out, timing out or unreachable),
+    rather than a problem with the request itself.
+    """
+    status = getattr(error, 'status', None)  # Set on HTTPStatusError.
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, CircuitOpenError):
+        return False
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+# Words in the "error" of an F-List reply that mean we're being throttled, or the site is struggling, rather than that
+# something was wrong with the request. F-List answers most errors with 200 OK and {"error": "..."}, so these would
+# otherwise never be noticed.
+OVERLOAD_ERRORS = ("too many", "rate limit", "flood", "slow down", "try again later", "temporarily", "overloaded")
+
+
+def is_overload_reply(reply):
+    """
+    :param reply: Decoded reply from one of F-List's JSON endpoints.
+    :return: Whether its error says F-List is throttling us or struggling. Other errors, like "Invalid ticket." or a
+    character that doesn't exist, are problems with the request, and are left to the caller.
+    """
+    if not isinstance(reply, dict):
+        return False
+    error = reply.get('error')
+    if not error or not isinstance(error, str):
+        return False
+    error = error.lower()
+    return any(words in error for words in OVERLOAD_ERRORS)
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Paces requests with a token bucket whose rate adjusts itself, AIMD style like TCP: every success raises the rate a
+    little (additive increase), and every sign of overload halves it (multiplicative decrease). That way, we settle on
+    whatever rate F-List is happy with at the moment instead of a guess.
+    """
+
+    def __init__(self, rate=20, min_rate=0.5, max_rate=50, increase=1, decrease=0.5, burst=4):
+        """
+        :param rate: Requests per second to start at.
+        :param min_rate: Lowest the rate can go.
+        :param max_rate: Highest the rate can go.
+        :param increase: Requests per second added for every second's worth of successes at the current rate.
+        :param decrease: What the rate is multiplied by when F-List is overloaded.
+        :param burst: Number of requests that may be made back to back after a quiet period.
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.decreases = 0
+        self.bucket = BlockingTokenBucket(1.0 / rate, burst)
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a request may be made.
+        """
+        self.bucket.acquire()
+
+    def _set_rate(self, rate):
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.bucket.configure(1.0 / self.rate, self.burst)
+
+    def success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._set_rate(self.rate + self.increase / self.rate)
+
+    def overloaded(self):
+        with self._lock:
+            now = time.monotonic()
+            # Requests already in flight when F-List started struggling will fail together; that's one signal, not
+            # several, so only back off once per round trip's worth of time.
+            if now - self._last_decrease < 1.0 / self.rate:
+                return
+            self._last_decrease = now
+            self.decreases += 1
+            self._set_rate(self.rate * self.decrease)
+
+
+class CircuitBreaker(object):
+    """
+    Stops making requests once enough of them have failed in a row, so a bot doesn't keep hammering an API that's down.
+    While open, every request fails straight away with CircuitOpenError. After reset_timeout seconds, a single trial
+    request is let through: if it works, requests go back to normal, and if not, the breaker stays open for another
+    reset_timeout.
+    """
+    logger = logging.getLogger("fchat")
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        :param failure_threshold: Number of failures in a row that opens the breaker.
+        :param reset_timeout: Number of seconds to stay open before trying again.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # "closed" (normal), "open" (failing fast) or "half-open" (trial request in flight).
+        self.failures = 0  # Failures in a row.
+        self.opened = 0  # Number of times the breaker has opened.
+        self.rejected = 0  # Requests failed fast while open.
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        """
+        Call before making a request.
+        :raises CircuitOpenError: If the request shouldn't be made.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and retry_in <= 0:
+                self.state = "half-open"
+                return
+            self.rejected += 1
+            raise CircuitOpenError(max(retry_in, 0))
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                self.logger.info("F-List's API is answering again.")
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                if self.state == "closed":
+                    self.opened += 1
+                    self.logger.warning("F-List's API failed %d times in a row; pausing requests for %d seconds.",
+                                        self.failures, self.reset_timeout)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Throttle(object):
+    """
+    Guards requests to F-List's JSON API: paces them with an AdaptiveRateLimiter, fails fast through a CircuitBreaker
+    while the API is down, and retries idempotent requests that failed from overload, with jittered exponential backoff.
+    Overload is an HTTP 429 or 5xx status, a timeout or connection error, or a reply whose error says we're being
+    throttled (see is_overload_reply()). Every HTTPClient has one, shared by all the clients using it.
+    """
+    logger = logging.getLogger("fchat")
+
+    def __init__(self, limiter=None, breaker=None, retries=3, backoff=0.5, max_backoff=10):
+        """
+        :param limiter: AdaptiveRateLimiter to pace requests with. Default has the default settings. False for no pacing.
+        :param breaker: CircuitBreaker to use. Default has the default settings. False to never fail fast.
+        :param retries: Most times to retry an idempotent request.
+        :param backoff: Seconds to wait, at most, before the first retry. Doubles every retry after that.
+        :param max_backoff: Longest to wait before a retry.
+        """
+        self.limiter = AdaptiveRateLimiter() if limiter is None else limiter or None
+        self.breaker = CircuitBreaker() if breaker is None else breaker or None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+    def call(self, function, *args, idempotent=True):
+        """
+        Makes a request.
+        :param function: Function that makes the request.
+        :param idempotent: Whether it's safe to make the request again if it might already have gone through. Requests
+        that aren't (Ex: sending a friend request) are never retried.
+        :return: Whatever function returns. If F-List kept replying that it's throttling us, that's the last reply.
+        :raises CircuitOpenError: If the breaker is open, or opens while retrying.
+        """
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.before()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            self.requests += 1
+            try:
+                result = function(*args)
+            except Exception as e:
+                if not is_overload(e):
+                    # Something was wrong with the request itself, but F-List did answer.
+                    if self.breaker is not None:
+                        self.breaker.success()
+                    raise
+                self._overloaded()
+                if not idempotent or attempt >= self.retries:
+                    self.failed += 1
+                    raise
+                self._back_off(attempt, e)
+                attempt += 1
+                continue
+
+            if is_overload_reply(result):
+                self._overloaded()
+                if not idempotent or attempt >= self.retries:
+                    self.failed += 1
+                    return result
+                self._back_off(attempt, result['error'])
+                attempt += 1
+                continue
+
+            if self.limiter is not None:
+                self.limiter.success()
+            if self.breaker is not None:
+                self.breaker.success()
+            return result
+
+    def _back_off(self, attempt, reason):
+        # "Full jitter": a random wait up to the backoff, so clients that failed together don't retry together.
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        self.retried += 1
+        self.logger.debug("Request failed (%s), retrying in %.2f seconds.", reason, delay)
+        time.sleep(delay)
+
+    def _overloaded(self):
+        if self.limiter is not None:
+            self.limiter.overloaded()
+        if self.breaker is not None:
+            self.breaker.failure()
+
+    def stats(self):
+        """
+        :return: Dictionary of requests (attempts made), retried, failed, rate (requests per second currently allowed),
+        circuit (breaker state) and rejected (requests failed fast while the breaker was open).
+        """
+        return {
+            'requests': self.requests,
+            'retried': self.retried,
+            'failed': self.failed,
+            'rate': self.limiter.rate if self.limiter is not None else None,
+            'circuit': self.breaker.state if self.breaker is not None else None,
+            'rejected': self.breaker.rejected if self.breaker is not None else 0,
+        }
@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from fchatpy.httppool import default_http_client
+from fchatpy.scheduler import default_scheduler
+
+TICKET_PATH = '/json/getApiTicket.php'
+TICKET_LIFETIME = 30 * 60  # Tickets are good for 30 minutes, and for any character on the account.
+
+
+def fetch_ticket(account, password, http=None):
+    """
+    Asks F-List.net for a new API ticket.
+    :param account: The account's username.
+    :param password: The account's password.
+    :param http: HTTPClient to ask with. Default is default_http_client().
+    :return: A (ticket, error) tuple. ticket is None if F-List refused, in which case error says why.
+    """
+    text_parsed = (http or default_http_client()).post(TICKET_PATH, {'account': account, 'password': password})
+    if 'ticket' in text_parsed:
+        return text_parsed['ticket'], None
+    return None, text_parsed.get('error')
+
+
+class TicketManager(object):
+    """
+    Hands out API tickets to every client that asks for one, one account at a time:
+    - Clients on the same account share their ticket, so connecting N characters costs one login instead of N.
+    - Only one fetch per account runs at a time. Anyone else asking meanwhile waits for that result.
+    - Tickets that are still being used get refreshed in the background shortly before they expire, so nobody has to
+    wait for a login round-trip in the middle of connecting or looking something up.
+    - Optionally, tickets are saved to a file only we can read, so restarting the bot doesn't cost a login either.
+    Every client shares default_ticket_manager() unless given its own. FChatManager makes one for its clients.
+    """
+    logger = logging.getLogger("fchat")
+    refresh_before = 5 * 60  # Seconds before a ticket expires to fetch a new one, if it's still in use.
+    retry_delay = 60  # Seconds to wait before trying a failed background refresh again.
+
+    def __init__(self, http=None, path=None, scheduler=None, background_refresh=True):
+        """
+        :param http: HTTPClient used to fetch tickets. Default is default_http_client().
+        :param path: File to keep tickets in between runs. None keeps them in memory only.
+        :param scheduler: Scheduler for background refreshes. Default is default_scheduler().
+        :param background_refresh: Set to False to only ever fetch tickets when someone asks for one.
+        """
+        self.http = http or default_http_client()
+        self.path = path
+        self.scheduler = scheduler or default_scheduler()
+        self.background_refresh = background_refresh
+        self.tickets = {}  # (ticket, time fetched) for each account. Key is account name (lower case).
+        self.fetches = 0  # Number of tickets fetched from F-List, in the background or not.
+        self.failures = 0  # Number of fetches that failed or were refused.
+        self.refreshes = 0  # Number of fetches done in the background.
+        self.hits = 0  # Number of times a ticket was handed out without fetching one.
+        self.last_latency = None  # Seconds the most recent fetch took.
+        self.total_latency = 0.0
+        self._credentials = {}  # (account, password, HTTPClient) of each account, for background refreshes.
+        self._last_used = {}  # time.time() each account's ticket was last asked for.
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._account_locks = {}
+        if path is not None:
+            self._load()
+
+    def _account_lock(self, key):
+        with self._lock:
+            lock = self._account_locks.get(key)
+            if lock is None:
+                lock = self._account_locks[key] = threading.Lock()
+            return lock
+
+    def get_ticket(self, account, password, new_ticket=False, http=None):
+        """
+        :param account: The account's username.
+        :param password: The account's password.
+        :param new_ticket: If true, fetches a new ticket even if the one we have hasn't expired yet, unless someone else
+        fetched one while we were waiting.
+        :param http: HTTPClient to fetch with, if not this manager's own.
+        :return: The ticket, or None if F-List refused to give us one.
+        """
+        key = account.lower()
+        asked_at = time.time()
+        self._last_used[key] = asked_at
+        self._credentials[key] = (account, password, http or self.http)
+        with self._account_lock(key):
+            cached = self.tickets.get(key)
+            if cached is not None:
+                ticket, fetched_at = cached
+                # A ticket fetched after we asked is as new as it gets, even if we asked for a new one.
+                if (not new_ticket and time.time() - fetched_at < TICKET_LIFETIME) or fetched_at >= asked_at:
+                    self.hits += 1
+                    if key not in self._timers:
+                        # Loaded from the file, so nothing knew the password to refresh it with until now.
+                        self._schedule_refresh(key, fetched_at + TICKET_LIFETIME - self.refresh_before - time.time())
+                    return ticket
+            return self._fetch(key)
+
+    def _fetch(self, key):
+        # Must be called with the account's lock held.
+        account, password, http = self._credentials[key]
+        self.logger.info("Fetching ticket for %s ...", account)
+        fetched_at = time.time()
+        started = time.monotonic()
+        try:
+            ticket, error = fetch_ticket(account, password, http)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.fetches += 1
+            self.last_latency = time.monotonic() - started
+            self.total_latency += self.last_latency
+
+        if ticket is None:
+            self.failures += 1
+            self.logger.error(error)
+            self.tickets.pop(key, None)
+            return None
+        self.tickets[key] = (ticket, fetched_at)
+        self._save()
+        self._schedule_refresh(key, fetched_at + TICKET_LIFETIME - self.refresh_before - time.time())
+        return ticket
+
+    def _schedule_refresh(self, key, delay):
+        if not self.background_refresh:
+            return
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._timers[key] = self.scheduler.call_later(max(delay, 0), self._start_refresh, key)
+
+    def _start_refresh(self, key):
+        # Runs on the scheduler's thread, which mustn't wait on the network, so the fetch gets a thread of its own.
+        threading.Thread(target=self._refresh, args=(key,), name="ticket-refresh", daemon=True).start()
+
+    def _refresh(self, key):
+        with self._lock:
+            self._timers.pop(key, None)
+        if time.time() - self._last_used.get(key, 0) > TICKET_LIFETIME:
+            # Nobody has asked for this account's ticket in a while, so let it lapse.
+            return
+        with self._account_lock(key):
+            try:
+                ticket = self._fetch(key)
+                self.refreshes += 1
+            except Exception:
+                self.logger.exception("Couldn't refresh ticket in the background.")
+                ticket = None
+            if ticket is None:
+                self._schedule_refresh(key, self.retry_delay)
+
+    def invalidate(self, account):
+        """
+        Forgets the account's ticket, so the next get_ticket() fetches a new one.
+        :param account: The account's username.
+        """
+        key = account.lower()
+        with self._lock:
+            self.tickets.pop(key, None)
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+        self._save()
+
+    def stats(self):
+        """
+        :return: Dictionary of fetches, refreshes (in the background), failures, hits, last_latency and average_latency
+        (in seconds).
+        """
+        return {
+            'fetches': self.fetches,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'hits': self.hits,
+            'last_latency': self.last_latency,
+            'average_latency': self.total_latency / self.fetches if self.fetches else None,
+        }
+
+    def close(self):
+        """
+        Stops refreshing tickets in the background.
+        """
+        with self._lock:
+            timers, self._timers = self._timers, {}
+        for timer in timers.values():
+            timer.cancel()
+
+    def _load(self):
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if mode & (stat.S_IRWXG | stat.S_IRWXO):
+            self.logger.warning("Not using saved tickets in %s, since other users can read it.", self.path)
+            return
+
+        try:
+            with open(self.path, "r") as ticket_file:
+                saved = json.load(ticket_file)
+        except (OSError, ValueError):
+            self.logger.warning("Couldn't read saved tickets from %s.", self.path, exc_info=True)
+            return
+
+        now = time.time()
+        for key, (ticket, fetched_at) in saved.items():
+            if now - fetched_at < TICKET_LIFETIME - self.refresh_before:
+                self.tickets[key] = (ticket, fetched_at)
+
+    def _save(self):
+        if self.path is None:
+            return
+        # One save at a time, each taking its copy of the tickets once the one before is done, so an older copy can never
+        # replace a newer one.
+        with self._save_lock:
+            with self._lock:
+                tickets = dict(self.tickets)
+            # Written to a new file of its own, only readable by us (mkstemp's default), and then moved over the old
+            # one, so it's never half written.
+            directory, name = os.path.split(os.path.abspath(self.path))
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory)
+                with os.fdopen(fd, "w") as ticket_file:
+                    json.dump(tickets, ticket_file)
+                os.replace(temp_path, self.path)
+            except OSError:
+                self.logger.warning("Couldn't save tickets to %s.", self.path, exc_info=True)
+                if temp_path is not None:
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+
+
+_default_ticket_manager = None
+_default_lock = threading.Lock()
+
+
+def default_ticket_manager():
+    """
+    :return: The TicketManager shared by every client that isn't given its own. It keeps tickets in memory only.
+    """
+    global _default_ticket_manager
+    with _default_lock:
+        if _default_ticket_manager is None:
+            _default_ticket_manager = TicketManager()
+        return _default_ticket_manager
@@ -1,14 +1,37 @@
+import sys
+
+# Values the server uses for a character's gender and status. Users only ever hold one of a handful of these, so they're
+# interned and shared between every User rather than each keeping its own copy.
+GENDERS = ("Male", "Female", "Transgender", "Herm", "Shemale", "Male-Herm", "Cunt-boy", "None")
+STATUSES = ("online", "looking", "busy", "dnd", "idle", "away", "crown")
+
+
 class User(object):
     """
-    This object class stores all the information needed to keep track of online users.
+    This object class stores all the information needed to keep track of online users. The server can easily tell us
+    about tens of thousands of these at once, so they're kept as small as possible: no per-object dict, shared gender and
+    status strings, and the status message stored as UTF-8 bytes.
     """
+    __slots__ = ('name', 'gender', 'status', '_message')
 
     def __init__(self, name, gender, status, message):
         self.name = name
-        self.gender = gender
-        self.status = status
+        self.gender = sys.intern(gender)
+        self.status = sys.intern(status)
         self.message = message
 
+    @property
+    def message(self):
+        return self._message.decode("UTF-8", "surrogatepass")
+
+    @message.setter
+    def message(self, message):
+        # JSON can escape a lone surrogate (Ex: "\\ud800"), which strict UTF-8 refuses to encode.
+        self._message = message.encode("UTF-8", "surrogatepass") if message else b''
+
     def update(self, status, message):
-        self.status = status
+        self.status = sys.intern(status)
         self.message = message
+
+    def __repr__(self):
+        return "User(%r, %r, %r, %r)" % (self.name, self.gender, self.status, self.message)
@@ -0,0 +1,97 @@
+import threading
+
+from fchatpy.registry import UserRegistry
+
+
+class WorldState(object):
+    """
+    Server-wide data shared by every client attached to it: the online users, the chatops and the server variables.
+    Every character on the server is told the same thing about these, so clients in the same process only need to keep
+    one copy between them. Channels, friends and ignores stay with each client.
+    One attached client at a time, the feeder, keeps the shared online user list up to date from its NLN, FLN, STA and
+    LIS messages; the others skip that work (and with lazy_decode, skip decoding those messages too). When the feeder
+    disconnects, another connected client takes over. The store is reference counted: once the last client detaches,
+    it's emptied out.
+    """
+
+    def __init__(self, user_registry=UserRegistry):
+        """
+        :param user_registry: Class used for the shared user list. Ex: ColumnarUserRegistry
+        """
+        self.users = user_registry()
+        self.operators = []
+        self.server_vars = {}
+        self.clients = []  # Attached clients, in the order they attached.
+        self.feeder = None  # Client whose messages keep self.users up to date.
+        self._lock = threading.RLock()
+
+    @property
+    def refs(self):
+        """
+        Number of clients attached.
+        """
+        return len(self.clients)
+
+    def attach(self, client):
+        """
+        Makes a client use the shared data instead of its own. Do this before it connects.
+        :param client: FChatClient or AsyncFChatClient object.
+        """
+        with self._lock:
+            if client in self.clients:
+                return
+            self.clients.append(client)
+            client.world = self
+            client.users = self.users
+            client.operators = self.operators
+            client.server_vars = self.server_vars
+
+    def detach(self, client):
+        """
+        Gives a client its own data back, empty, and stops sharing with it.
+        :param client: FChatClient or AsyncFChatClient object.
+        """
+        with self._lock:
+            if client not in self.clients:
+                return
+            self.client_disconnected(client)
+            self.clients.remove(client)
+            client.world = None
+            client.users = client.user_registry()
+            client.operators = []
+            client.server_vars = {}
+            if not self.clients:
+                self.clear()
+
+    def client_connected(self, client):
+        """
+        Called by attached clients when their connection opens. The first one connected becomes the feeder.
+        """
+        with self._lock:
+            if self.feeder is None:
+                # Nobody has been keeping the user list up to date, so it's stale. The new feeder's LIS refills it.
+                self.users.clear()
+                self.feeder = client
+
+    def client_disconnected(self, client):
+        """
+        Called by attached clients when their connection closes. If it was the feeder, another connected client takes
+        over.
+        """
+        with self._lock:
+            if self.feeder is not client:
+                return
+            self.feeder = None
+            for other in self.clients:
+                if other is not client and other.connected:
+                    self.feeder = other
+                    break
+
+    def is_feeder(self, client):
+        return self.feeder is client
+
+    def clear(self):
+        self.users.clear()
+        del self.operators[:]
+        self.server_vars.clear()
+        self.feeder = None
@@ -6,6 +6,7 @@ setup(
     author='Build-A-Buddha',
     python_requires='>=3',
     install_requires=['websocket-client>=1.5.1'],
+    extras_require={'fast': ['orjson'], 'async': ['websockets']},
     packages=["fchatpy"],
     url='https://github.com/BuildABuddha/fchatpy'
 )
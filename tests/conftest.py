@@ -0,0 +1,5 @@
+import os
+import sys
+
+# So a plain "pytest" finds fchatpy in this checkout, without installing the package first.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
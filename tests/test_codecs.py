@@ -0,0 +1,209 @@
+"""
+Conformance tests for the JSON codecs: every codec that's installed must decode and encode the same data as the json
+module, and every handler must see the same arguments and leave the same state behind whichever codec decoded the
+message.
+"""
+import json
+import math
+
+import pytest
+
+from fchatpy.client import COMMANDS, FChatProtocol
+from fchatpy.codec import JSONCodec, available_codecs, get_codec
+
+CODECS = available_codecs()
+
+# JSON text, as the server could send it, including what the faster decoders have trouble with.
+TEXTS = [
+    '{"character":"Bob","message":"Hello, world!"}',
+    '{"message":"caf\\u00e9 \\u00fcber été 日本語"}',
+    '{"message":"😀 and \\ud83d\\ude00"}',
+    '{"message":"\\"quoted\\" \\\\ back\\/slash \\b\\f\\n\\r\\t \\u0000 </script>"}',
+    '{"message":"lone \\ud800 surrogate"}',
+    '{"message":"lone \\udfff low surrogate"}',
+    '{"small":-9223372036854775808,"large":18446744073709551615}',
+    '{"count":18446744073709551616}',
+    '{"count":-9223372036854775809}',
+    '{"count":123456789012345678901234567890}',
+    '{"text":"1234567890123456789012345 in a string"}',
+    '{"value":0.5,"big":1e16,"tiny":1e-7,"exact":1.0,"long":0.1000000000000000055511151231257827}',
+    '{"value":NaN}',
+    '{"value":Infinity,"other":-Infinity}',
+    '{"a":1,"a":2}',
+    '{"nested":{"list":[1,[2,[3,{"four":null}]]],"flags":[true,false]}}',
+    '[]',
+    '""',
+]
+
+# Data we could send, including what the faster encoders have trouble with.
+DATA = [
+    {"recipient": "Bob", "message": "Hello, world!"},
+    {"message": "café 日本語 😀"},
+    {"message": "\"quoted\" \\ back/slash \b\f\n\r\t \x00 </script>"},
+    {"message": "lone \ud800 surrogate"},
+    {"count": 2 ** 63 - 1, "negative": -2 ** 63},
+    {"count": 2 ** 64},
+    {"count": -2 ** 64},
+    {"count": 123456789012345678901234567890},
+    {"value": float("nan")},
+    {"value": float("inf"), "other": float("-inf")},
+    {"nested": {"list": [1, [2, (3, {"four": None})]], "flags": [True, False]}},
+    {1: "integer key"},
+]
+
+
+def _recording(handler_name):
+    def handler(self, *args, **kwargs):
+        self.calls.append((handler_name, repr(args), repr(sorted(kwargs.items()))))
+        return getattr(FChatProtocol, handler_name)(self, *args, **kwargs)
+    handler.__name__ = handler_name
+    return handler
+
+
+class RecordingProtocol(FChatProtocol):
+    """
+    Runs the default handlers, but writes down what each was called with, and what was queued to send.
+    """
+
+    def __init__(self, codec):
+        super().__init__("account", "password", "Test Bot", codec=codec)
+        self.calls = []
+        self.sent = []
+
+    def send_message(self, cmd, data):
+        self.sent.append((cmd, self.codec.dumps(data)))
+        return super().send_message(cmd, data)
+
+    # Every on_XXX handler, wrapped to record its arguments.
+    vars().update({handler_name: _recording(handler_name) for handler_name, _ in COMMANDS.values()})
+
+
+# A session's worth of frames, with at least one of every command the client understands.
+FRAMES = [
+    'IDN {"character":"Test Bot"}',
+    'VAR {"variable":"chat_max","value":4096}',
+    'VAR {"variable":"msg_flood","value":0.5}',
+    'VAR {"variable":"icon_blacklist","value":["one","two"]}',
+    'HLO {"message":"Welcome. Running F-Chat (0.8.6-Lua). Enjoy your stay."}',
+    'CON {"count":18446744073709551616}',
+    'FRL {"characters":["Friend One","Fr\\u00efend Two"]}',
+    'IGN {"action":"init","characters":["Ignored One"]}',
+    'IGN {"action":"add","character":"Ignored Two"}',
+    'IGN {"action":"delete","character":"Ignored One"}',
+    'ADL {"ops":["Op One","Op Two"]}',
+    'AOP {"character":"Op Three"}',
+    'DOP {"character":"Op Two"}',
+    'LIS {"characters":[["Bob","Male","online",""],["Al\\u00efce","Female","looking","caf\\u00e9 \\ud83d\\ude00"],'
+    '["Carol","Herm","busy","lone \\ud800 surrogate"],["Dave","None","away","\\"quotes\\" and \\\\"]]}',
+    'NLN {"identity":"Erin","gender":"Female","status":"online"}',
+    'STA {"status":"dnd","character":"Bob","statusmsg":"Busy \\u2014 back soon"}',
+    'CHA {"channels":[{"name":"Frontpage","mode":"chat","characters":12345678901234567890123},'
+    '{"name":"Caf\\u00e9","mode":"both","characters":0}]}',
+    'ORS {"channels":[{"name":"ADH-0123456789abcdef","characters":5,"title":"Private \\ud83d\\ude00 Room"}]}',
+    'JCH {"character":{"identity":"Test Bot"},"channel":"ADH-0123456789abcdef","title":"Private Room"}',
+    'ICH {"users":[{"identity":"Test Bot"},{"identity":"Bob"},{"identity":"Al\\u00efce"}],'
+    '"channel":"ADH-0123456789abcdef","mode":"both"}',
+    'CDS {"channel":"ADH-0123456789abcdef","description":"[b]Rules[/b]\\n1. Be nice \\u2764\\ufe0f\\n2. \\ud800"}',
+    'COL {"channel":"ADH-0123456789abcdef","oplist":["Bob","Carol"]}',
+    'JCH {"character":{"identity":"Dave"},"channel":"ADH-0123456789abcdef","title":"Private Room"}',
+    'COA {"character":"Dave","channel":"ADH-0123456789abcdef"}',
+    'COR {"character":"Carol","channel":"ADH-0123456789abcdef"}',
+    'CSO {"character":"Dave","channel":"ADH-0123456789abcdef"}',
+    'RMO {"mode":"chat","channel":"ADH-0123456789abcdef"}',
+    'MSG {"character":"Bob","message":"Hi \\ud83d\\ude00 <3 \\u00e9","channel":"ADH-0123456789abcdef"}',
+    'LRP {"channel":"ADH-0123456789abcdef","message":"Looking for RP \\u2605","character":"Al\\u00efce"}',
+    'RLL {"channel":"ADH-0123456789abcdef","results":[3,18446744073709551616],"type":"dice","message":"rolls",'
+    '"rolls":["1d6","1d20"],"character":"Bob","endresult":18446744073709551619}',
+    'RLL {"channel":"ADH-0123456789abcdef","type":"bottle","message":"spins the bottle","target":"Dave",'
+    '"character":"Bob"}',
+    'CKU {"operator":"Bob","channel":"ADH-0123456789abcdef","character":"Dave"}',
+    'JCH {"character":{"identity":"Dave"},"channel":"ADH-0123456789abcdef","title":"Private Room"}',
+    'CBU {"operator":"Bob","channel":"ADH-0123456789abcdef","character":"Dave"}',
+    'CTU {"operator":"Bob","channel":"ADH-0123456789abcdef","length":30,"character":"Dave"}',
+    'LCH {"channel":"ADH-0123456789abcdef","character":"Al\\u00efce"}',
+    'PRI {"character":"Bob","message":"lone \\udfff and pair \\ud83d\\ude00"}',
+    'TPN {"character":"Bob","status":"typing"}',
+    'CIU {"sender":"Bob","title":"Other Room","name":"ADH-fedcba9876543210"}',
+    'RTB {"type":"friendadd","name":"Friend Three"}',
+    'RTB {"type":"note","sender":"Bob","id":123456789012345678901234567890,"subject":"Hi \\u00e9"}',
+    'SFC {"action":"report","moderator":"Op One","character":"Bob","timestamp":1e16,"callid":"x"}',
+    'SYS {"message":"Server message \\ud83d\\ude00"}',
+    'SYS {"message":"Channel message","channel":"ADH-0123456789abcdef"}',
+    'UPT {"time":1234567890,"starttime":1234560000,"startstring":"Fri Feb 13","accepted":123456789012345678901,'
+    '"channels":1e16,"users":NaN,"maxusers":Infinity}',
+    'ERR {"message":"Error \\u00e9","number":-9223372036854775809}',
+    'BRO {"message":"Broadcast \\ud83d\\ude00"}',
+    'FKS {"characters":["Bob","Al\\u00efce"],"kinks":[1,18446744073709551616]}',
+    'KID {"type":"start","message":"Kinks of Bob","character":"Bob"}',
+    'KID {"type":"custom","character":"Bob","key":"Caf\\u00e9","value":"\\ud83d\\ude00"}',
+    'KID {"type":"end","message":"End of kinks","character":"Bob"}',
+    'PRD {"type":"info","message":"Profile","key":"Age","value":"\\u221e"}',
+    'PIN',
+    'FLN {"character":"Dave"}',
+    'XYZ {"unknown":"command"}',
+]
+
+
+def _snapshot(client):
+    """
+    :return: Everything the handlers keep track of, in a form where ints and floats (and NaNs) only compare equal to
+    themselves.
+    """
+    channels = {key: (channel.id, channel.title, channel.mode, channel.num_characters, channel.description,
+                      repr(channel.character_list), repr(channel.owner), repr(channel.channel_ops))
+                for key, channel in client.channels.items()}
+    return repr((sorted((name, repr(user)) for name, user in client.users.items()), sorted(channels.items()),
+                 client.friends, client.ignored_users, client.operators, sorted(client.server_vars.items()),
+                 sorted(client.user_channels.items()), client.state, client.connected, client.expected_users,
+                 client.users_received, client.rate_limiter.intervals))
+
+
+def _run(codec, frames):
+    client = RecordingProtocol(codec)
+    client.connection_opened()
+    for frame in frames:
+        client.received_message(None, frame)
+    if client._ready_timer is not None:
+        client._ready_timer.cancel()
+    return client
+
+
+def test_frames_cover_every_command():
+    assert set(COMMANDS) <= {frame[:3] for frame in FRAMES}
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("text", TEXTS)
+def test_loads_matches_json(codec, text):
+    assert repr(get_codec(codec).loads(text)) == repr(JSONCodec().loads(text))
+    assert repr(get_codec(codec).loads(text.encode("UTF-8", "surrogatepass"))) == repr(JSONCodec().loads(text))
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("data", DATA, ids=repr)
+def test_dumps_matches_json(codec, data):
+    text = get_codec(codec).dumps(data)
+    assert repr(JSONCodec().loads(text)) == repr(JSONCodec().loads(JSONCodec().dumps(data)))
+    if not any(isinstance(value, float) and math.isfinite(value) for value in data.values()):
+        assert text == JSONCodec().dumps(data)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_dumps_floats(codec):
+    data = {"value": 0.5, "big": 1e16, "tiny": 1e-7, "exact": 1.0, "third": 1 / 3}
+    assert json.loads(get_codec(codec).dumps(data)) == data
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_handlers_match_json(codec):
+    expected = _run("json", FRAMES)
+    client = _run(codec, FRAMES)
+    assert client.calls == expected.calls
+    assert client.sent == expected.sent
+    assert _snapshot(client) == _snapshot(expected)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_every_handler_is_called(codec):
+    client = _run(codec, FRAMES)
+    assert {name for name, _, _ in client.calls} == {handler_name for handler_name, _ in COMMANDS.values()}
@@ -0,0 +1,161 @@
+"""
+Tests for the connection lifecycle that don't need a server: what goes out, and in what order, around reconnects.
+"""
+import threading
+import time
+
+from fchatpy.client import FChatClient, FChatProtocol
+
+
+class QueueOnlyProtocol(FChatProtocol):
+    """
+    Queues messages like any client, but nothing takes them off the queue except the test.
+    """
+
+    ready_timeout = 0
+
+    def __init__(self):
+        super().__init__("account", "password", "Test Bot")
+        self.ticket = "ticket"
+        self.ready_calls = 0
+
+    def on_ready(self):
+        self.ready_calls += 1
+
+
+def _drain(client):
+    """
+    :return: Commands of every message that may be sent right now, in the order they'd go out.
+    """
+    sent = []
+    while True:
+        frame, wait = client.outgoing_buffer.poll()
+        if frame is None:
+            return sent
+        sent.append(frame[0])
+
+
+def test_ping_taken_when_socket_dies_is_not_sent_before_idn():
+    client = QueueOnlyProtocol()
+    client.connection_opened()
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    assert _drain(client) == ["IDN"]
+
+    client.PIN()
+    client.STA("busy", "Back soon")
+    frame, wait = client.outgoing_buffer.poll()
+    assert frame[0] == "PIN"
+    # The write failed because the socket just died.
+    assert not client.outgoing_buffer.requeue(*frame)
+    client.connection_closed()
+
+    client.connection_opened()
+    assert _drain(client) == ["IDN"]
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    assert _drain(client) == ["STA"]
+
+
+def test_ping_queued_while_disconnected_is_not_sent_before_idn():
+    client = QueueOnlyProtocol()
+    client.connection_opened()
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    _drain(client)
+    client.connection_closed()
+
+    client.PIN()
+    client.MSG("Frontpage", "Hello!")
+    client.connection_opened()
+    assert _drain(client) == ["IDN"]
+
+
+def test_requeued_messages_go_first():
+    client = QueueOnlyProtocol()
+    client.connection_opened()
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    _drain(client)
+    client.JCH("Frontpage")
+    client.JCH("Development")
+    frame, wait = client.outgoing_buffer.poll()
+    assert client.outgoing_buffer.requeue(*frame)
+    assert [data['channel'] for cmd, data in [client.outgoing_buffer.poll()[0] for _ in range(2)]] == [
+        "Frontpage", "Development"]
+
+
+READY_FRAMES = ['ADL {"ops":[]}', 'FRL {"characters":[]}', 'IGN {"action":"init","characters":[]}',
+                'LIS {"characters":[]}', 'PIN']
+
+
+def test_on_ready_runs_once_when_timeout_comes_first():
+    client = QueueOnlyProtocol()
+    client.connection_opened()
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    client._ready_timed_out()
+    for frame in READY_FRAMES:
+        client.received_message(None, frame)
+    assert client.state == "ready"
+    assert client.ready_calls == 1
+
+
+def test_on_ready_runs_once_when_timeout_comes_last():
+    client = QueueOnlyProtocol()
+    client.connection_opened()
+    client.received_message(None, 'IDN {"character":"Test Bot"}')
+    for frame in READY_FRAMES:
+        client.received_message(None, frame)
+    client._ready_timed_out()
+    assert client.ready_calls == 1
+
+
+def test_ready_timeout_does_not_run_on_ready_on_scheduler_thread():
+    ran = threading.Event()
+    threads = []
+
+    class TimeoutClient(FChatClient):
+        ready_timeout = 0.05
+
+        def get_ticket(self, new_ticket=False):
+            return "ticket"
+
+        def send(self, data, *args, **kwargs):
+            pass
+
+        def on_ready(self):
+            threads.append(threading.current_thread())
+            ran.set()
+
+    client = TimeoutClient("account", "password", "Test Bot")
+    client.setup()
+    try:
+        client.on_opened(None)
+        client.received_message(None, 'IDN {"character":"Test Bot"}')
+        assert ran.wait(5)
+        assert client.state == "ready"
+        assert threads[0] is not client.scheduler._thread
+    finally:
+        client.terminate_threads()
+
+
+def test_keep_connected_backs_off_on_the_scheduler():
+    attempts = []
+
+    class FlakyClient(FChatClient):
+        def get_ticket(self, new_ticket=False):
+            return "ticket"
+
+        def run_forever(self, *args, **kwargs):
+            # Every connection drops right away.
+            attempts.append((time.monotonic(), threading.current_thread()))
+            if len(attempts) == 3:
+                self.stop()
+
+    client = FlakyClient("account", "password", "Test Bot")
+    client.reconnect_delay = 0.05
+    client.keep_connected()
+    assert client.wait(5)
+    time.sleep(0.3)
+    assert len(attempts) == 3
+    assert attempts[1][0] - attempts[0][0] >= 0.05
+    assert attempts[2][0] - attempts[1][0] >= 0.1
+    assert all(thread is not threading.current_thread() and thread is not client.scheduler._thread
+               for _, thread in attempts)
+    assert client.reconnect_attempt == 2